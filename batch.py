@@ -0,0 +1,212 @@
+"""
+Batch ingestion for the Lab Report Digitization system
+Runs the full pipeline over a directory of reports or a manifest file (one path per line) with a pool
+of worker processes, and appends one JSON line per report to an NDJSON file. Rerunning with the same
+output file skips reports already in it (failed ones too, unless --retry-failed is given), so an
+interrupted backfill picks up where it stopped.
+
+    python batch.py archive/ --out outputs/archive.ndjson --workers 8
+    python batch.py manifest.txt --out outputs/archive.ndjson       # resumes by default
+    python batch.py archive/ --out outputs/archive.ndjson --retry-failed
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg", ".tif", ".tiff")
+
+_api = None
+
+def list_inputs(source):
+    # A directory (searched recursively) or a manifest; manifest paths are relative to the manifest
+    if os.path.isdir(source):
+        found = []
+        for dirpath, _, names in os.walk(source):
+            found += [os.path.join(dirpath, n) for n in names if n.lower().endswith(EXTENSIONS)]
+        return sorted(os.path.abspath(p) for p in found)
+    base = os.path.dirname(os.path.abspath(source))
+    paths = []
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                paths.append(os.path.abspath(os.path.join(base, line)))
+    return list(dict.fromkeys(paths))
+
+def load_done(out_path, retry_failed=False):
+    # Inputs already in the output file; a torn last line (killed mid-write) is cut off first
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if rec.get("status") == "ok" or not retry_failed:
+            done.add(rec.get("input"))
+    return done
+
+def init_worker(quiet=True):
+    # Each worker loads the OCR/extraction components once and OCRs its report's pages inline;
+    # parallelism comes from running one report per worker
+    global _api
+    os.environ["OCR_WORKERS"] = "1"
+    import main as api
+    if quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+    api.warm_up()
+    _api = api
+
+def process(path):
+    t0 = time.perf_counter()
+    try:
+        result = _api.run_lab_report(path)
+        meta = result.get("metadata", {})
+        return {"input": path, "status": "ok", "seconds": round(time.perf_counter() - t0, 3),
+                "pages": meta.get("processed_images") or 0, "result": result}
+    except Exception as e:
+        return {"input": path, "status": "error", "seconds": round(time.perf_counter() - t0, 3),
+                "pages": 0, "error": f"{type(e).__name__}: {e}"}
+
+class Progress:
+    def __init__(self, total, every=1.0, stream=sys.stderr):
+        self.total = total
+        self.every = every
+        self.stream = stream
+        self.done = self.failed = self.pages = 0
+        self.t0 = time.perf_counter()
+        self._last = 0.0
+
+    def update(self, rec):
+        self.done += 1
+        self.pages += rec["pages"]
+        self.failed += rec["status"] != "ok"
+        now = time.perf_counter()
+        if now - self._last >= self.every or self.done == self.total:
+            self._last = now
+            self.stream.write("\r" + self.line() + " " * 4)
+            self.stream.flush()
+
+    def line(self):
+        elapsed = time.perf_counter() - self.t0
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else 0.0
+        return (f"{self.done}/{self.total} reports ({self.failed} failed) | "
+                f"{rate:.2f} reports/s, {self.pages / elapsed if elapsed > 0 else 0:.2f} pages/s | "
+                f"elapsed {fmt_secs(elapsed)}, ETA {fmt_secs(eta)}")
+
+def fmt_secs(s):
+    s = int(s)
+    return f"{s // 3600}:{s // 60 % 60:02d}:{s % 60:02d}"
+
+class NDJSONWriter:
+    # Buffers records and appends them in bulk: every `batch` records or `interval` seconds
+    def __init__(self, path, batch=50, interval=2.0):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.f = open(path, "a", encoding="utf-8")
+        self.batch = batch
+        self.interval = interval
+        self.buf = []
+        self._last = time.perf_counter()
+
+    def write(self, rec):
+        self.buf.append(json.dumps(rec, ensure_ascii=False) + "\n")
+        if len(self.buf) >= self.batch or time.perf_counter() - self._last >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.buf:
+            self.f.write("".join(self.buf))
+            self.f.flush()
+            os.fsync(self.f.fileno())
+            self.buf = []
+        self._last = time.perf_counter()
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+def run_pool(paths, workers, on_result, verbose=False):
+    # Keeps a bounded window of reports in flight so Ctrl+C stops promptly and memory stays flat
+    if workers == 1:
+        init_worker(not verbose)
+        for p in paths:
+            on_result(process(p))
+        return
+    window = workers * 2
+    todo = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(not verbose,)) as pool:
+        pending = set()
+        try:
+            while True:
+                for p in todo:
+                    pending.add(pool.submit(process, p))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    on_result(f.result())
+        except KeyboardInterrupt:
+            for f in pending:
+                f.cancel()
+            raise
+
+def main():
+    parser = argparse.ArgumentParser(description="Digitize a directory or manifest of lab reports into NDJSON")
+    parser.add_argument("source", help="Directory of reports, or a manifest file with one path per line")
+    parser.add_argument("--out", default=os.path.join(ROOT, "outputs", "batch.ndjson"), help="NDJSON output file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Reports processed in parallel")
+    parser.add_argument("--no-resume", action="store_true", help="Reprocess inputs already in the output file")
+    parser.add_argument("--retry-failed", action="store_true", help="On resume, rerun inputs that failed before")
+    parser.add_argument("--flush-every", type=int, default=50, help="Records buffered before each append")
+    parser.add_argument("--verbose", action="store_true", help="Keep pipeline INFO logging")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        print(f"❌ No such directory or manifest: {args.source}")
+        return 1
+    paths = list_inputs(args.source)
+    done = set() if args.no_resume else load_done(args.out, args.retry_failed)
+    todo = [p for p in paths if p not in done]
+    print(f"📂 {len(paths)} report(s) found, {len(paths) - len(todo)} already in {args.out}, {len(todo)} to process")
+    if not todo:
+        return 0
+
+    workers = max(1, min(args.workers, len(todo)))
+    print(f"👷 {workers} worker(s)")
+    writer = NDJSONWriter(args.out, batch=args.flush_every)
+    progress = Progress(len(todo))
+
+    def on_result(rec):
+        writer.write(rec)
+        progress.update(rec)
+
+    try:
+        run_pool(todo, workers, on_result, args.verbose)
+    except KeyboardInterrupt:
+        print(f"\n👋 Interrupted after {progress.done} report(s); rerun the same command to resume")
+        return 130
+    finally:
+        writer.close()
+    print()
+    print(f"✅ {progress.line()}")
+    print(f"📄 Results appended to {args.out}")
+    return 1 if progress.failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""
+Offline benchmark for the Lab Report Digitization system
+Times each stage on the repo's own fixtures (data/processed page images and tokens, data/corrections)
+and scores extraction against the corrections. Writes JSON and can compare against a stored baseline.
+
+    python benchmark.py                                  # run, write benchmarks/bench_<timestamp>.json
+    python benchmark.py --save-baseline                  # run and store benchmarks/baseline.json
+    python benchmark.py --compare benchmarks/baseline.json   # exit 1 on regressions
+"""
+import os
+import sys
+import glob
+import json
+import time
+import platform
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+class Timer:
+    def __init__(self):
+        self.samples = {}
+
+    def time(self, stage, fn, *args, **kwargs):
+        t0 = time.perf_counter()
+        out = fn(*args, **kwargs)
+        self.samples.setdefault(stage, []).append(time.perf_counter() - t0)
+        return out
+
+    def summary(self):
+        out = {}
+        for stage, s in self.samples.items():
+            a = np.array(s) * 1000.0
+            out[stage] = {"n": len(s), "p50_ms": round(float(np.percentile(a, 50)), 3),
+                          "p95_ms": round(float(np.percentile(a, 95)), 3), "total_ms": round(float(a.sum()), 3)}
+        return out
+
+def bench_images(timer, preprocessor, ocr, images, repeat):
+    import cv2
+    for _ in range(repeat):
+        for path in images:
+            gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+            timer.time("deskew", preprocessor._deskew, gray)
+            cleaned = timer.time("clean", preprocessor.clean_array, gray)
+            if ocr is not None:
+                timer.time("tesseract", ocr.extract_text_with_positions, cleaned, page_path=path)
+
+def bench_extraction(timer, components, token_files, repeat):
+    from modules.token_store import load_tokens
+    ocr, tables, rules, enhanced = components
+    stores = [load_tokens(p)["tokens"] for p in token_files]
+    tokens = [s.to_dicts() for s in stores]
+    result = None
+    for _ in range(repeat):
+        text = ""
+        for t in tokens:
+            lines = timer.time("extract_lines", ocr.extract_lines, t)
+            text += "".join(ocr.get_line_text(l) + "\n" for l in lines)
+        rows = timer.time("tables", tables.extract_pages, stores)
+        timer.time("rules", rules.extract, text)
+        result = timer.time("enhanced", enhanced.extract_with_ml_enhancement, text, [dict(r) for r in rows])
+    return result
+
+def score_corrections(rules, dictionary, correction_files):
+    # Ground truth: each correction's `original.tests` names are raw OCR lines; re-extract them
+    # and count corrected tests recovered (same value), extra rows, and dictionary coverage
+    found = expected = extracted = matched = named = canonical = 0
+    for path in correction_files:
+        with open(path, "r", encoding="utf-8") as f:
+            c = json.load(f)
+        orig, corr = c.get("original") or {}, c.get("corrected") or {}
+        text = "\n".join(t.get("name", "") for t in orig.get("tests") or [])
+        got = rules.extract(text)["tests"]
+        truth = corr.get("tests") or []
+        values = [t.get("value") for t in got]
+        expected += len(truth)
+        found += sum(1 for t in truth if t.get("value") in values)
+        extracted += len(got)
+        matched += sum(1 for v in values if any(v == t.get("value") for t in truth))
+        named += len(truth)
+        canonical += sum(1 for t in truth if dictionary.match(t.get("name", ""))[0] is not None)
+    return {
+        "reports": len(correction_files),
+        "tests_expected": expected,
+        "tests_recall": round(found / expected, 4) if expected else None,
+        "tests_precision": round(matched / extracted, 4) if extracted else None,
+        "dictionary_coverage": round(canonical / named, 4) if named else None,
+    }
+
+def compare(result, baseline, tolerance):
+    # Slower p50/p95 beyond `tolerance` (relative) or lower accuracy counts as a regression
+    regressions = []
+    for stage, cur in result["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base:
+            continue
+        for k in ("p50_ms", "p95_ms"):
+            # Ignore sub-0.05ms noise
+            if base[k] > 0.05 and cur[k] > base[k] * (1 + tolerance):
+                regressions.append(f"{stage}.{k}: {base[k]} -> {cur[k]} (+{(cur[k] / base[k] - 1) * 100:.0f}%)")
+    for k, v in result["accuracy"].items():
+        b = baseline.get("accuracy", {}).get(k)
+        if isinstance(v, float) and isinstance(b, float) and v < b - 0.005:
+            regressions.append(f"accuracy.{k}: {b} -> {v}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark pipeline stages on the stored fixtures")
+    parser.add_argument("--data", default=os.path.join(ROOT, "data"), help="Folder with processed/ and corrections/")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the fixtures per stage")
+    parser.add_argument("--skip-images", action="store_true", help="Only benchmark the token/extraction stages")
+    parser.add_argument("--tesseract", default=None, help="Path to the tesseract binary")
+    parser.add_argument("--out", default=None, help="Result JSON (default benchmarks/bench_<timestamp>.json)")
+    parser.add_argument("--compare", default=None, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown per stage")
+    parser.add_argument("--save-baseline", action="store_true", help="Also write benchmarks/baseline.json")
+    args = parser.parse_args()
+
+    from modules.preprocessing import FilePreprocessor
+    from modules.ocr_processor import OCRProcessor
+    from modules.rule_based_extractor import RuleBasedExtractor
+    from modules.table_extractor import TableExtractor
+    from modules.analyte_dictionary import AnalyteDictionary
+    from modules.ml_extractor import SimpleMLExtractor, EnhancedExtractor
+
+    processed = os.path.join(args.data, "processed")
+    images = sorted(glob.glob(os.path.join(processed, "page_*.png")))
+    token_files = sorted(glob.glob(os.path.join(processed, "tokens_page_*.json")) +
+                         glob.glob(os.path.join(processed, "tokens_page_*.tokens")))
+    correction_files = sorted(glob.glob(os.path.join(args.data, "corrections", "*.json")))
+
+    notes = []
+    # Line grouping doesn't need tesseract; only the tesseract stage is skipped without it
+    lines = ocr = OCRProcessor(tesseract_path=args.tesseract)
+    try:
+        ocr.warm_up()
+    except Exception as e:
+        ocr = None
+        notes.append(f"tesseract stage skipped: {e}")
+    preprocessor = FilePreprocessor()
+    rules = RuleBasedExtractor()
+    dictionary = AnalyteDictionary()
+    ml = SimpleMLExtractor(model_dir=os.path.join(ROOT, "models"))
+    ml.load_models()
+    enhanced = EnhancedExtractor(rules, ml, None, dictionary)
+
+    timer = Timer()
+    t0 = time.perf_counter()
+    if images and not args.skip_images:
+        bench_images(timer, preprocessor, ocr, images, args.repeat)
+    image_wall = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    extraction = bench_extraction(timer, (lines, TableExtractor(), rules, enhanced), token_files, args.repeat) \
+        if token_files else None
+    extract_wall = time.perf_counter() - t0
+
+    pages = len(token_files) or len(images)
+    result = {
+        "timestamp": datetime.now().isoformat(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "fixtures": {"images": len(images), "token_pages": len(token_files), "corrections": len(correction_files)},
+        "repeat": args.repeat,
+        "stages": timer.summary(),
+        "throughput": {
+            "image_pages_per_sec": round(len(images) * args.repeat / image_wall, 2)
+            if images and not args.skip_images else None,
+            "extraction_pages_per_sec": round(pages * args.repeat / extract_wall, 2) if token_files else None,
+        },
+        "accuracy": score_corrections(rules, dictionary, correction_files),
+        "extracted_tests": len(extraction["tests"]) if extraction else None,
+        "peak_rss_mb": peak_rss_mb(),
+        "notes": notes,
+    }
+
+    os.makedirs(os.path.join(ROOT, "benchmarks"), exist_ok=True)
+    out = args.out or os.path.join(ROOT, "benchmarks", f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    if args.save_baseline:
+        with open(os.path.join(ROOT, "benchmarks", "baseline.json"), "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+    print(f"{'stage':<15}{'n':>6}{'p50 ms':>12}{'p95 ms':>12}")
+    for stage, s in result["stages"].items():
+        print(f"{stage:<15}{s['n']:>6}{s['p50_ms']:>12.3f}{s['p95_ms']:>12.3f}")
+    print(f"throughput: {result['throughput']}  peak RSS: {result['peak_rss_mb']} MB")
+    print(f"accuracy: {result['accuracy']}")
+    for n in notes:
+        print(f"note: {n}")
+    print(f"📄 Wrote {out}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.tolerance)
+        if regressions:
+            print("❌ Regressions vs baseline:")
+            for r in regressions:
+                print(f"  {r}")
+            return 1
+        print("✅ No regressions vs baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
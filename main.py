@@ -2,11 +2,13 @@
 Main FastAPI Application - Lab Report Digitization System
 Combines all modules into a REST API with demo interface
 """
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse, FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-import tempfile
+import asyncio
 import os
+import time
+import threading
 import json
 import logging
 from typing import Dict, Optional
@@ -18,6 +20,17 @@ from modules.preprocessing import FilePreprocessor
 from modules.ocr_processor import OCRProcessor
 from modules.rule_based_extractor import RuleBasedExtractor
 from modules.ml_extractor import SimpleMLExtractor, HITLManager, EnhancedExtractor
+from modules.pipeline import PagePipeline, PIPELINE_VERSION
+from modules.cache import DiskCache, sha256_file, content_key
+from modules.workspace import Workspace, new_job_id
+from modules.jobs import JobManager, QueueFull
+from modules.job_queue import SQLiteJobQueue
+from modules.table_extractor import TableExtractor
+from modules.analyte_dictionary import AnalyteDictionary, normalize
+from modules.trainer import BackgroundTrainer
+from modules.metrics import Registry
+from modules.profiler import JobProfiler, should_profile
+from modules.layout_templates import LayoutTemplates
 
 # ---------- Project root + path helper ----------
 PROJECT_ROOT = Path(__file__).resolve().parent
@@ -44,22 +57,143 @@ app.add_middleware(
 )
 
 # ---------- Ensure project-local directories exist ----------
-for d in ["data/input", "data/processed", "data/corrections", "outputs", "static", "models"]:
+for d in ["data/input", "data/processed", "data/corrections", "data/cache", "data/queue", "data/layouts", "outputs", "static", "models"]:
     os.makedirs(P(d), exist_ok=True)
 
 # ---------- Initialize components (Windows tool paths configurable) ----------
 # Adjust these paths if installed elsewhere
 preprocessor = FilePreprocessor(poppler_path=r"C:\poppler-25.07.0\Library\bin")
-ocr_processor = OCRProcessor(tesseract_path=r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+ocr_processor = OCRProcessor(
+    tesseract_path=r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+    # Fast low-res pass + full-res re-OCR of low-confidence lines only
+    two_pass=os.environ.get("OCR_TWO_PASS", "0") == "1",
+    token_format=os.environ.get("TOKEN_FORMAT", "json")
+)
 rule_extractor = RuleBasedExtractor()
+# Read test rows from result-table geometry; TABLE_EXTRACTION=0 falls back to text rules only
+table_extractor = TableExtractor() if os.environ.get("TABLE_EXTRACTION", "1") == "1" else None
 ml_extractor = SimpleMLExtractor(model_dir=P("models"))
 hitl_manager = HITLManager(corrections_dir=P("data/corrections"))
 
-# Load ML models if present
-ml_extractor.load_models()
+# Canonical test names; ANALYTE_DICTIONARY=<json> adds lab-specific entries to the defaults
+analyte_path = os.environ.get("ANALYTE_DICTIONARY")
+analyte_dictionary = AnalyteDictionary.from_json(analyte_path) if analyte_path else AnalyteDictionary()
 
 # Combined extractor (rule-based + ML)
-enhanced_extractor = EnhancedExtractor(rule_extractor, ml_extractor, hitl_manager)
+enhanced_extractor = EnhancedExtractor(rule_extractor, ml_extractor, hitl_manager, analyte_dictionary)
+
+# Result cache (keyed by upload SHA-256) and page cache (keyed by rendered page pixels)
+MB = 1024 * 1024
+result_cache = DiskCache(P("data/cache/results"), int(os.environ.get("RESULT_CACHE_MB", 256)) * MB)
+page_cache = DiskCache(P("data/cache/pages"), int(os.environ.get("PAGE_CACHE_MB", 512)) * MB)
+
+# Persist per-job page images and tokens under data/processed/<job_id> for debugging
+KEEP_ARTIFACTS = os.environ.get("KEEP_ARTIFACTS", "0") == "1"
+
+# Recurring lab layouts: boilerplate regions learned per template are blanked out before OCR
+# (LAYOUT_TEMPLATES=0 disables)
+layout_templates = LayoutTemplates(P("data/layouts/templates.db")) \
+    if os.environ.get("LAYOUT_TEMPLATES", "1") == "1" else None
+
+# Page cleaning + OCR worker pool (size from OCR_WORKERS, defaults to CPU count)
+page_pipeline = PagePipeline(preprocessor, ocr_processor, page_cache=page_cache, layouts=layout_templates)
+
+# Background jobs; admission is bounded by estimated cost (pages x DPI^2) in flight.
+# JOB_BACKEND=sqlite hands jobs to separate `worker.py` processes through a durable queue.
+JOB_QUEUE_MAX_COST = float(os.environ.get("JOB_QUEUE_MAX_COST", 200))
+# How long /upload and /upload/stream wait on a queued job before handing back its ID (sqlite backend)
+UPLOAD_WAIT_SECONDS = float(os.environ.get("UPLOAD_WAIT_SECONDS", 600))
+job_manager = JobManager(
+    max_cost=JOB_QUEUE_MAX_COST,
+    max_concurrent=int(os.environ.get("JOB_CONCURRENCY", 2))
+)
+job_queue = None
+if os.environ.get("JOB_BACKEND", "local") == "sqlite":
+    job_queue = SQLiteJobQueue(
+        P("data/queue/jobs.db"),
+        max_cost=JOB_QUEUE_MAX_COST,
+        lease_seconds=float(os.environ.get("JOB_LEASE_SECONDS", 300))
+    )
+
+# Retrain off the request path: every RETRAIN_BATCH new corrections or RETRAIN_INTERVAL seconds
+trainer = BackgroundTrainer(
+    ml_extractor, hitl_manager,
+    batch=int(os.environ.get("RETRAIN_BATCH", 5)),
+    interval=float(os.environ.get("RETRAIN_INTERVAL", 30))
+)
+
+# ---------- Warm-up and readiness ----------
+# Building the components above is cheap: OpenCV, pytesseract, pdf2image and scikit-learn are imported,
+# tesseract is probed and the model is loaded by warm_up(). `run.py --workers N` calls it once before
+# forking; otherwise the startup hook runs it in the background while /livez already answers.
+# RUN_TRAINER=0 leaves retraining to another process and reloads its model versions instead.
+RUN_TRAINER = os.environ.get("RUN_TRAINER", "1") == "1"
+READINESS = {"ready": False, "warm_up_seconds": None, "components": {}}
+_warm_up_lock = threading.Lock()
+
+def warm_up() -> Dict:
+    with _warm_up_lock:
+        if READINESS["warm_up_seconds"] is not None:
+            return READINESS
+        t0 = time.perf_counter()
+        components = {}
+        for name, component in (("preprocessor", preprocessor), ("ocr", ocr_processor), ("ml_extractor", ml_extractor)):
+            try:
+                components[name] = {"status": "ready", **component.warm_up()}
+            except Exception as e:
+                logger.error("Warm-up of %s failed: %s", name, e)
+                components[name] = {"status": "error", "error": str(e)}
+        READINESS.update(ready=all(c["status"] == "ready" for c in components.values()),
+                         warm_up_seconds=round(time.perf_counter() - t0, 3), components=components)
+        logger.info("Warm-up finished in %.2fs (ready: %s)", READINESS["warm_up_seconds"], READINESS["ready"])
+        return READINESS
+
+# Opt-in profiling: "X-Profile: 1" / ?profile=1 per request, or a sampled fraction of all jobs
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = P("outputs", "profiles")
+
+# ---------- Metrics (in-memory, served at /metrics) ----------
+metrics = Registry()
+STAGE_SECONDS = metrics.histogram("labreport_stage_seconds", "Seconds per pipeline stage (page stages observed per page)", ["stage"])
+PAGE_SECONDS = metrics.histogram("labreport_page_seconds", "Seconds to produce one page's tokens", ["source"])
+REPORT_SECONDS = metrics.histogram("labreport_report_seconds", "End-to-end seconds per report", ["cache"])
+PAGES = metrics.counter("labreport_pages_total", "Pages processed", ["source"])
+TOKENS = metrics.counter("labreport_tokens_total", "Tokens produced by OCR or text layers")
+TESSERACT_CALLS = metrics.counter("labreport_tesseract_calls_total", "tesseract subprocess invocations")
+REPORTS = metrics.counter("labreport_reports_total", "Reports processed", ["cache"])
+RESULTS_WRITTEN = metrics.counter("labreport_results_written_total", "Result files written to outputs/")
+CORRECTIONS = metrics.counter("labreport_corrections_received_total", "Corrections received via /correct")
+LAYOUT_PAGES = metrics.counter("labreport_layout_pages_total", "Rendered pages by layout template outcome", ["result"])
+metrics.gauge("labreport_cache_lookups", "Cache lookups since start", ["cache", "result"], fn=lambda: {
+    (name, r): c.stats()[k] for name, c in (("results", result_cache), ("pages", page_cache))
+    for r, k in (("hit", "hits"), ("miss", "misses"))})
+metrics.gauge("labreport_jobs_inflight", "Queued + running jobs",
+              fn=lambda: (job_queue.stats() if job_queue else job_manager.stats())["inflight_jobs"])
+metrics.gauge("labreport_jobs_inflight_cost", "Admission cost units in flight",
+              fn=lambda: (job_queue.stats() if job_queue else job_manager.stats())["inflight_cost"])
+metrics.gauge("labreport_corrections", "Corrections stored", fn=lambda: hitl_manager.count())
+metrics.gauge("labreport_model_version", "Live ML model version", fn=lambda: ml_extractor.version)
+metrics.gauge("labreport_ocr_workers", "OCR pool size", fn=lambda: page_pipeline.workers)
+
+# /stats counts result files from this listing (taken once) plus the counter above
+STARTED_AT = time.time()
+RESULTS_AT_START = len([f for f in os.listdir(P("outputs")) if f.endswith(".json")])
+
+@app.on_event("startup")
+def start_background():
+    # Serve (and answer /livez) right away; warm up, then start the trainer, in the background.
+    # Queue workers importing this module never start the trainer; they reload new model versions.
+    def warm_then_train():
+        status = warm_up()
+        # Never retrain over a model that failed to load
+        if RUN_TRAINER and status["components"]["ml_extractor"]["status"] == "ready":
+            trainer.start()
+    threading.Thread(target=warm_then_train, name="warm-up", daemon=True).start()
+
+@app.on_event("shutdown")
+def shutdown_pipeline():
+    trainer.stop()
+    page_pipeline.shutdown()
 
 # ---------- Routes ----------
 @app.get("/", response_class=HTMLResponse)
@@ -96,12 +230,10 @@ async def root():
       if(!file) return alert('Please select a file');
       const result=document.getElementById('result');
       const loading=document.getElementById('loading');
-      loading.style.display='block'; result.innerHTML='';
+      loading.style.display='block'; loading.innerHTML='🔄 Processing...'; result.innerHTML='';
       const fd=new FormData(); fd.append('file',file);
-      try{
-        const r=await fetch('/upload',{method:'POST',body:fd});
-        const data=await r.json(); if(!r.ok) throw new Error(data.detail||'Error');
-        let html='<div class="result"><div class="ok">✅ Processed</div>';
+      function render(data,label='✅ Processed'){
+        let html=`<div class="result"><div class="ok">${label}</div>`;
         if(data.patient){
           html+='<h4>👤 Patient</h4>';
           for(const [k,v] of Object.entries(data.patient)){
@@ -122,7 +254,31 @@ async def root():
           html+='<h4>⚠️ Needs Review</h4><ul>'+data.needs_review.map(x=>`<li>${x}</li>`).join('')+'</ul>';
         }
         html+='<h4>📋 JSON</h4><pre>'+JSON.stringify(data,null,2)+'</pre></div>';
-        result.innerHTML=html;
+        return html;
+      }
+      try{
+        // Stream page events so rows show up as soon as the first page is done
+        const r=await fetch('/upload/stream',{method:'POST',body:fd});
+        if(!r.ok){const d=await r.json(); throw new Error(d.detail||'Error');}
+        const reader=r.body.getReader(); const dec=new TextDecoder(); let buf=''; const rows=[];
+        for(;;){
+          const {value,done}=await reader.read(); if(done) break;
+          buf+=dec.decode(value,{stream:true});
+          let i;
+          while((i=buf.indexOf('\n'))>=0){
+            const line=buf.slice(0,i); buf=buf.slice(i+1); if(!line.trim()) continue;
+            const ev=JSON.parse(line);
+            if(ev.event==='page'){
+              rows.push(...ev.tests);
+              loading.innerHTML=`🔄 Page ${ev.pages_done}/${ev.pages_total} done (${rows.length} test rows so far)`;
+              result.innerHTML=render({tests:rows},'⏳ Partial results');
+            }else if(ev.event==='error'){
+              throw new Error(ev.detail||'Processing error');
+            }else if(ev.event==='result'){
+              result.innerHTML=render(ev.result);
+            }
+          }
+        }
       }catch(err){
         result.innerHTML=`<div class="err">Error: ${err.message}</div>`;
       }finally{
@@ -132,53 +288,317 @@ async def root():
     </script></body></html>"""
     return html
 
-@app.post("/upload")
-async def upload_report(file: UploadFile = File(...)):
+def wants_profile(request: Request, profile: Optional[str] = None) -> bool:
+    return should_profile(profile or request.headers.get("x-profile"), PROFILE_SAMPLE_RATE)
+
+async def enqueue_upload(file: UploadFile, on_event=None, profile: bool = False) -> str:
+    # `on_event(event)` is called from the processing thread for start/page events (local backend only)
     allowed = ['application/pdf', 'image/jpeg', 'image/png', 'image/jpg']
     if file.content_type not in allowed:
         raise HTTPException(status_code=400, detail=f"Unsupported file type: {file.content_type}")
 
-    with tempfile.NamedTemporaryFile(delete=False, dir=P("data/input"), suffix=f"_{file.filename}") as tmp:
-        tmp.write(await file.read())
-        path = tmp.name
-
+    # Each job gets its own input directory and output ID, so concurrent uploads never collide;
+    # durable jobs spool into data/queue so workers on a shared volume can read them
+    ws = Workspace(P("data/queue" if job_queue else "data/input")).__enter__()
+    path = ws.file(file.filename or f"upload.{file.content_type.split('/')[-1]}")
+    with open(path, "wb") as f:
+        f.write(await file.read())
     try:
-        result = await process_lab_report(path)
-        fname = f"result_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-        with open(P("outputs", fname), "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
-        result["output_file"] = fname
-        return result
+        pages = await asyncio.to_thread(preprocessor.page_count, path)
     except Exception as e:
-        logger.exception("Processing error")
-        raise HTTPException(status_code=500, detail=f"Processing error: {e}")
-    finally:
-        if os.path.exists(path):
-            try:
-                os.unlink(path)
-            except PermissionError:
-                pass
+        ws.cleanup()
+        raise HTTPException(status_code=400, detail=f"Could not read file: {e}")
+
+    def work(progress):
+        try:
+            return run_job(path, ws.job_id, progress, on_event, profile)
+        finally:
+            ws.cleanup()
 
-async def process_lab_report(file_path: str) -> Dict:
-    processed_images = preprocessor.process_file(file_path, P("data/processed"))
-    all_tokens = []
+    try:
+        if job_queue:
+            cost = JobManager.estimate_cost(pages, preprocessor.dpi)
+            await asyncio.to_thread(job_queue.enqueue, ws.job_id, path, pages, cost, profile)
+        else:
+            job_manager.submit(ws.job_id, work, pages, preprocessor.dpi)
+    except QueueFull as e:
+        ws.cleanup()
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return ws.job_id
+
+async def job_status(job_id: str, include_result: bool = True) -> Optional[Dict]:
+    if not job_queue:
+        job = job_manager.get(job_id)
+        return job.to_dict(include_result) if job else None
+    status = await asyncio.to_thread(job_queue.get, job_id)
+    if status and include_result and status["status"] == "done":
+        with open(P("outputs", status["output_file"]), "r", encoding="utf-8") as f:
+            status["result"] = json.load(f)
+        status["result"]["output_file"] = status["output_file"]
+    return status
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: Request, file: UploadFile = File(...), profile: Optional[str] = None):
+    job_id = await enqueue_upload(file, profile=wants_profile(request, profile))
+    return {**await job_status(job_id, include_result=False), "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    status = await job_status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return status
+
+@app.get("/jobs/{job_id}/profile")
+async def get_job_profile(job_id: str, format: str = "json"):
+    # Summary JSON (time split, top functions/allocations) or the raw cProfile dump (?format=prof)
+    name = os.path.basename(job_id) + (".prof" if format == "prof" else ".json")
+    path = os.path.join(PROFILE_DIR, name)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"No profile for job: {job_id}")
+    return FileResponse(path, filename=f"profile_{name}")
+
+@app.post("/upload")
+async def upload_report(request: Request, file: UploadFile = File(...), profile: Optional[str] = None):
+    # Synchronous wrapper over the job queue
+    job_id = await enqueue_upload(file, profile=wants_profile(request, profile))
+    if job_queue:
+        # No worker.py running (or all busy) must not hold the request forever
+        deadline = time.monotonic() + UPLOAD_WAIT_SECONDS
+        while (await job_status(job_id, include_result=False))["status"] not in ("done", "failed"):
+            if time.monotonic() > deadline:
+                raise HTTPException(status_code=504, headers={"Location": f"/jobs/{job_id}"}, detail={
+                    "message": f"Job not finished after {UPLOAD_WAIT_SECONDS:.0f}s; poll its status_url",
+                    "job_id": job_id, "status_url": f"/jobs/{job_id}"})
+            await asyncio.sleep(0.5)
+    else:
+        await job_manager.get(job_id).done.wait()
+    status = await job_status(job_id)
+    if status["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Processing error: {status.get('error')}")
+    return status["result"]
+
+@app.post("/upload/stream")
+async def upload_report_stream(request: Request, file: UploadFile = File(...), format: Optional[str] = None,
+                               profile: Optional[str] = None):
+    # Page events as pages finish, then the merged result. NDJSON by default; Server-Sent
+    # Events with ?format=sse or "Accept: text/event-stream".
+    sse = format == "sse" or "text/event-stream" in request.headers.get("accept", "")
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    job_id = await enqueue_upload(file, on_event=lambda ev: loop.call_soon_threadsafe(events.put_nowait, ev),
+                                  profile=wants_profile(request, profile))
+
+    def encode(event):
+        body = json.dumps(event, ensure_ascii=False, default=str)
+        return f"event: {event['event']}\ndata: {body}\n\n" if sse else body + "\n"
+
+    async def stream():
+        if job_queue:
+            # Pages run in a worker process; report progress from the queue instead
+            last = None
+            deadline = time.monotonic() + UPLOAD_WAIT_SECONDS
+            while True:
+                status = await job_status(job_id, include_result=False)
+                if status["status"] in ("done", "failed"):
+                    break
+                if time.monotonic() > deadline:
+                    yield encode({"event": "timeout", "job_id": job_id, "status_url": f"/jobs/{job_id}",
+                                  "detail": f"Job not finished after {UPLOAD_WAIT_SECONDS:.0f}s"})
+                    return
+                if status["pages_done"] != last:
+                    last = status["pages_done"]
+                    yield encode({"event": "progress", "job_id": job_id, "status": status["status"],
+                                  "pages_done": last, "pages_total": status["pages_total"]})
+                await asyncio.sleep(0.5)
+        else:
+            done = asyncio.create_task(job_manager.get(job_id).done.wait())
+            while not (done.done() and events.empty()):
+                get = asyncio.create_task(events.get())
+                await asyncio.wait({get, done}, return_when=asyncio.FIRST_COMPLETED)
+                if get.done():
+                    yield encode(get.result())
+                else:
+                    get.cancel()
+        status = await job_status(job_id)
+        if status["status"] == "failed":
+            yield encode({"event": "error", "job_id": job_id, "detail": status.get("error")})
+        else:
+            yield encode({"event": "result", "result": status["result"]})
+
+    return StreamingResponse(stream(), media_type="text/event-stream" if sse else "application/x-ndjson",
+                             headers={"X-Job-Id": job_id, "Cache-Control": "no-cache"})
+
+def write_result(result: Dict, job_id: str) -> Dict:
+    t0 = time.perf_counter()
+    fname = f"result_{job_id}.json"
+    with open(P("outputs", fname), "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    result["output_file"] = fname
+    STAGE_SECONDS.observe(time.perf_counter() - t0, stage="write")
+    RESULTS_WRITTEN.inc()
+    return result
+
+async def process_lab_report(file_path: str, job_id: Optional[str] = None) -> Dict:
+    # OCR is CPU-bound and blocking; keep the event loop free for other requests
+    return await asyncio.to_thread(run_lab_report, file_path, job_id)
+
+def run_job(file_path: str, job_id: str, progress=None, on_event=None, profile: bool = False) -> Dict:
+    # Process + write the result; profiled jobs skip the result cache and keep pages in this
+    # thread so the profile covers rendering, cleaning and tesseract waits
+    if not profile:
+        return write_result(run_lab_report(file_path, job_id, progress, on_event), job_id)
+    with JobProfiler(PROFILE_DIR, job_id) as prof:
+        result = run_lab_report(file_path, job_id, progress, on_event, profiled=True)
+    if prof.summary:
+        result["metadata"]["profile"] = {
+            k: prof.summary[k] for k in ("wall_seconds", "cpu_seconds", "external_seconds", "python_seconds",
+                                         "peak_traced_mb")}
+        result["metadata"]["profile"]["url"] = f"/jobs/{job_id}/profile"
+    return write_result(result, job_id)
+
+def run_lab_report(file_path: str, job_id: Optional[str] = None, progress=None, on_event=None,
+                   profiled: bool = False) -> Dict:
+    # Drains iter_lab_report; `on_event` sees the start/page events as they happen
+    result = None
+    for event in iter_lab_report(file_path, job_id, profiled):
+        if event["event"] == "result":
+            result = event["result"]
+            continue
+        if event["event"] == "page" and progress:
+            progress(event["pages_done"], event["pages_total"])
+        if on_event:
+            on_event(event)
+    return result
+
+def iter_lab_report(file_path: str, job_id: Optional[str] = None, profiled: bool = False):
+    # Generator: "start", one "page" event per page as it finishes (with that page's partial
+    # extraction), then a "result" event with the merged extraction over all pages
+    t_start = time.perf_counter()
+    warm_up()  # no-op once warm; waits for a warm-up still in progress
+    if not RUN_TRAINER:
+        ml_extractor.refresh()
+    job_id = job_id or new_job_id()
+    file_hash = sha256_file(file_path)
+    cache_key = content_key(file_hash, PIPELINE_VERSION, preprocessor.dpi, preprocessor.use_text_layer,
+                            ocr_processor.two_pass, ml_extractor.version, table_extractor is not None,
+                            analyte_dictionary.version)
+    cached = None if profiled else result_cache.get(cache_key)
+    if cached is not None:
+        cached["metadata"].update({
+            "job_id": job_id,
+            "cache": "hit",
+            "processing_timestamp": datetime.now().isoformat(),
+            "original_filename": os.path.basename(file_path),
+            "timings": {"total": round(time.perf_counter() - t_start, 4)}
+        })
+        REPORT_SECONDS.observe(time.perf_counter() - t_start, cache="hit")
+        REPORTS.inc(cache="hit")
+        yield {"event": "start", "job_id": job_id, "pages_total": cached["metadata"].get("processed_images"), "cache": "hit"}
+        yield {"event": "result", "result": cached}
+        return
+
+    # Page images/tokens stay in memory unless KEEP_ARTIFACTS asks for a per-job debug copy
+    artifacts_dir = P("data/processed", job_id) if KEEP_ARTIFACTS else None
+    count = preprocessor.page_count(file_path)
+    yield {"event": "start", "job_id": job_id, "pages_total": count, "cache": "miss"}
+    pages = []
+    t_pages = time.perf_counter()
+    partial_time = 0.0
+    for page in page_pipeline.iter_pages(file_path, artifacts_dir, count, inline=profiled):
+        pages.append(page)
+        PAGES.inc(source=page["source"])
+        TOKENS.inc(len(page["tokens"]))
+        TESSERACT_CALLS.inc(page.get("tesseract_calls", 0))
+        if page.get("layout"):
+            layout = page["layout"]
+            LAYOUT_PAGES.inc(result="unmatched" if layout["template"] is None else "full" if layout["full"] else "masked")
+        PAGE_SECONDS.observe(sum(page["timings"].values()), source=page["source"])
+        for stage, secs in page["timings"].items():
+            STAGE_SECONDS.observe(secs, stage=stage)
+        t0 = time.perf_counter()
+        # This page on its own: its lines, and table rows if the page carries its own header
+        rows = table_extractor.extract(page["tokens"], page=page["page"])[0] if table_extractor else None
+        partial = enhanced_extractor.extract_with_ml_enhancement("\n".join(page["tokens"].line_texts()), rows)
+        partial_time += time.perf_counter() - t0
+        yield {
+            "event": "page",
+            "page": page["page"],
+            "pages_done": len(pages),
+            "pages_total": count,
+            "source": page["source"],
+            "tokens": len(page["tokens"]),
+            "preprocessing": page.get("preprocessing"),
+            "patient": partial["patient"],
+            "tests": partial["tests"],
+            "timings": {k: round(v, 4) for k, v in page["timings"].items()}
+        }
+    pages.sort(key=lambda p: p["page"])
+    timings = page_pipeline.sum_timings(pages, time.perf_counter() - t_pages - partial_time)
+    timings["partial"] = partial_time
+    logger.info("OCR'd %d page(s) in %.2fs", len(pages), timings["pages_wall"])
+    total_tokens = 0
     all_text = ""
 
-    for img in processed_images:
-        o = ocr_processor.extract_text_with_positions(img, P("data/processed"))
-        all_tokens.extend(o["tokens"])
-        lines = ocr_processor.extract_lines(o["tokens"])
-        for line in lines:
-            all_text += ocr_processor.get_line_text(line) + "\n"
+    t0 = time.perf_counter()
+    for page in pages:
+        # Pages come back as columnar TokenStores; group lines without per-token dicts
+        total_tokens += len(page["tokens"])
+        for line in page["tokens"].line_texts():
+            all_text += line + "\n"
+    timings["lines"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    table_rows = table_extractor.extract_pages([p["tokens"] for p in pages]) if table_extractor else None
+    timings["tables"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    extraction = enhanced_extractor.extract_with_ml_enhancement(all_text, table_rows, timings)
+    timings["extract"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    learn_layouts(pages, extraction)
+    timings["layouts"] = time.perf_counter() - t0
+    timings["total"] = time.perf_counter() - t_start
+    for stage in ("lines", "tables", "rules", "ml", "partial"):
+        STAGE_SECONDS.observe(timings[stage], stage=stage)
+    REPORT_SECONDS.observe(timings["total"], cache="miss")
+    REPORTS.inc(cache="miss")
 
-    extraction = enhanced_extractor.extract_with_ml_enhancement(all_text)
     extraction["metadata"] = {
-        "processed_images": len(processed_images),
-        "total_tokens": len(all_tokens),
+        "job_id": job_id,
+        "file_sha256": file_hash,
+        "cache": "miss",
+        "processed_images": len(pages),
+        "total_tokens": total_tokens,
         "processing_timestamp": datetime.now().isoformat(),
-        "original_filename": os.path.basename(file_path)
+        "original_filename": os.path.basename(file_path),
+        "ocr_workers": page_pipeline.workers,
+        "text_layer_pages": sum(1 for p in pages if p["source"] == "text_layer"),
+        "ocr_recheck_regions": sum(p.get("recheck_regions", 0) for p in pages),
+        "preprocessing": [{"page": p["page"], **p["preprocessing"]} for p in pages if "preprocessing" in p],
+        "layout_templates": [{"page": p["page"], "template": p["layout"]["template"], "score": p["layout"]["score"],
+                              "skipped_regions": len(p["layout"]["skip"])} for p in pages if p.get("layout")],
+        "timings": {k: round(v, 4) for k, v in timings.items()}
     }
-    return extraction
+    result_cache.put(cache_key, extraction)
+    yield {"event": "result", "result": extraction}
+
+def learn_layouts(pages, extraction):
+    # Freshly OCR'd pages teach their layout templates. The result table (header and everything
+    # below it, every parsed row) and lines that yielded patient fields or dictionary-matched
+    # tests are never learned as boilerplate.
+    if layout_templates is None or not any(p["source"] == "ocr" and p.get("layout") for p in pages):
+        return
+    protected = [normalize(str(v)) for v in extraction["patient"].values() if v not in ("", None)]
+    protected += [normalize(t["name"]) for t in extraction["tests"] if t.get("code")]
+    try:
+        if table_extractor is not None:
+            for page, keep in zip(pages, table_extractor.table_tokens([p["tokens"] for p in pages])):
+                page["keep"] = keep
+        layout_templates.learn([p for p in pages if p["source"] == "ocr"], protected)
+    except Exception:
+        logger.exception("Layout template learning failed")
 
 @app.post("/correct")
 async def submit_correction(
@@ -192,37 +612,73 @@ async def submit_correction(
             data.get("corrected", {}),
             report_id
         )
-        corrections = hitl_manager.get_training_data()
-        if len(corrections) >= 5:
-            scores = ml_extractor.train(corrections)
-            return {"message": "Correction saved and model retrained", "correction_id": cid, "training_scores": scores}
-        return {"message": "Correction saved", "correction_id": cid, "note": f"Need {5-len(corrections)} more corrections to retrain"}
+        CORRECTIONS.inc()
+        if layout_templates is not None:
+            # Deleted bogus tests (letterhead/footer lines) mark those lines as boilerplate
+            try:
+                layout_templates.learn_correction(data)
+            except Exception:
+                logger.exception("Layout template correction failed")
+        total = hitl_manager.count()
+        trainer.notify()
+        if total >= trainer.min_total:
+            return {"message": "Correction saved; model retraining scheduled", "correction_id": cid,
+                    "model_version": ml_extractor.version}
+        return {"message": "Correction saved", "correction_id": cid, "note": f"Need {trainer.min_total-total} more corrections to retrain"}
     except Exception as e:
         logger.exception("Save correction error")
         raise HTTPException(status_code=500, detail=f"Could not save correction: {e}")
 
 @app.get("/health")
 async def health_check():
+    components = READINESS["components"]
     return {
-        "status": "healthy",
+        "status": "healthy" if READINESS["ready"] else "starting" if not components else "degraded",
         "timestamp": datetime.now().isoformat(),
         "components": {
-            "preprocessor": "ready",
-            "ocr": "ready",
+            "preprocessor": components.get("preprocessor", {}).get("status", "not_loaded"),
+            "ocr": components.get("ocr", {}).get("status", "not_loaded"),
             "rule_extractor": "ready",
             "ml_extractor": "trained" if ml_extractor.is_trained else "not_trained"
         }
     }
 
+@app.get("/livez")
+async def liveness():
+    # The process is up and its event loop responds; says nothing about the pipeline
+    return {"status": "alive", "pid": os.getpid(), "uptime_seconds": round(time.time() - STARTED_AT, 1)}
+
+@app.get("/readyz")
+async def readiness():
+    # 503 until warm-up has imported and probed every component (or if one failed)
+    body = {"status": "ready" if READINESS["ready"] else "not_ready", "pid": os.getpid(), **READINESS}
+    if not READINESS["ready"]:
+        return JSONResponse(body, status_code=503)
+    return body
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/stats")
 async def get_stats():
-    corrections = hitl_manager.get_training_data()
-    outputs = len([f for f in os.listdir(P("outputs")) if f.endswith(".json")])
+    # Served from counters; nothing here lists directories
+    written = RESULTS_WRITTEN.total()
+    if job_queue:
+        # Queue workers write results in their own processes
+        written = await asyncio.to_thread(job_queue.count_done, STARTED_AT)
     return {
-        "total_corrections": len(corrections),
-        "total_processed_reports": outputs,
+        "total_corrections": hitl_manager.count(),
+        "total_processed_reports": RESULTS_AT_START + written,
+        "pages_processed": PAGES.total(),
+        "tesseract_calls": TESSERACT_CALLS.total(),
         "ml_model_trained": ml_extractor.is_trained,
-        "available_field_classifiers": list(ml_extractor.field_classifiers.keys()) if ml_extractor.is_trained else []
+        "available_field_classifiers": list(ml_extractor.field_classifiers.keys()) if ml_extractor.is_trained else [],
+        "model": trainer.stats(),
+        "cache": {"results": result_cache.stats(), "pages": page_cache.stats()},
+        "jobs": job_queue.stats() if job_queue else job_manager.stats(),
+        "layouts": layout_templates.stats() if layout_templates else None
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,224 @@
+"""
+Module 13: Canonical analyte dictionary
+Goal: Map raw test-name fragments from OCR (typos, abbreviations, trailing values) to canonical
+tests with codes and default units, via an n-gram inverted index instead of scanning every entry
+"""
+import re
+import json
+import hashlib
+from collections import Counter
+
+# (code, canonical name, default unit, aliases) -- codes follow LOINC where one is common
+DEFAULT_ANALYTES = [
+    # Haematology
+    ("718-7", "Hemoglobin", "g/dL", ["Haemoglobin", "Hb", "Hgb"]),
+    ("4544-3", "Hematocrit", "%", ["Haematocrit", "PCV", "Packed Cell Volume"]),
+    ("789-8", "Red Blood Cell Count", "10^6/uL", ["RBC", "Total RBC", "RBC Count", "Erythrocyte Count"]),
+    ("6690-2", "White Blood Cell Count", "10^3/uL", ["WBC", "Total Leucocytes Count", "TLC", "Total WBC Count", "Leukocyte Count"]),
+    ("777-3", "Platelet Count", "10^3/uL", ["Platelets", "PLT"]),
+    ("787-2", "Mean Corpuscular Volume", "fL", ["MCV"]),
+    ("785-6", "Mean Corpuscular Hemoglobin", "pg", ["MCH"]),
+    ("786-4", "Mean Corpuscular Hemoglobin Concentration", "g/dL", ["MCHC", "Mean Corp Hemo Conc"]),
+    ("788-0", "Red Cell Distribution Width CV", "%", ["RDW-CV", "RDW"]),
+    ("21000-5", "Red Cell Distribution Width SD", "fL", ["RDW-SD"]),
+    ("32623-1", "Mean Platelet Volume", "fL", ["MPV"]),
+    ("32207-3", "Platelet Distribution Width", "fL", ["PDW"]),
+    ("51637-7", "Plateletcrit", "%", ["PCT"]),
+    ("48386-7", "Platelet Large Cell Ratio", "%", ["P-LCR", "PLCR", "Platelet to Large Cell Ratio"]),
+    ("770-8", "Neutrophils %", "%", ["Neutrophils", "Neutrophil Percentage", "Polymorphs"]),
+    ("736-9", "Lymphocytes %", "%", ["Lymphocytes", "Lymphocyte Percentage"]),
+    ("5905-5", "Monocytes %", "%", ["Monocytes", "Monocyte Percentage"]),
+    ("713-8", "Eosinophils %", "%", ["Eosinophils", "Eosinophil Percentage"]),
+    ("706-2", "Basophils %", "%", ["Basophils", "Basophil Percentage"]),
+    ("71695-1", "Immature Granulocytes %", "%", ["Immature Granulocyte Percentage", "IG%"]),
+    ("751-8", "Neutrophils Absolute Count", "10^3/uL", ["ANC", "Absolute Neutrophil Count"]),
+    ("731-0", "Lymphocytes Absolute Count", "10^3/uL", ["ALC", "Absolute Lymphocyte Count"]),
+    ("742-7", "Monocytes Absolute Count", "10^3/uL", ["Absolute Monocyte Count"]),
+    ("711-2", "Eosinophils Absolute Count", "10^3/uL", ["AEC", "Absolute Eosinophil Count"]),
+    ("704-7", "Basophils Absolute Count", "10^3/uL", ["Absolute Basophil Count"]),
+    ("53115-2", "Immature Granulocytes Absolute Count", "10^3/uL", ["Immature Granulocytes", "IG"]),
+    ("4537-7", "Erythrocyte Sedimentation Rate", "mm/hr", ["ESR"]),
+    # Lipids
+    ("2093-3", "Total Cholesterol", "mg/dL", ["Cholesterol", "Serum Cholesterol", "Cholesterol Total"]),
+    ("2085-9", "HDL Cholesterol", "mg/dL", ["HDL", "HDL Cholesterol Direct", "High Density Lipoprotein"]),
+    ("18262-6", "LDL Cholesterol", "mg/dL", ["LDL", "LDL Cholesterol Direct", "Low Density Lipoprotein"]),
+    ("13458-5", "VLDL Cholesterol", "mg/dL", ["VLDL"]),
+    ("2571-8", "Triglycerides", "mg/dL", ["Triglyceride", "TG", "Serum Triglycerides"]),
+    ("43396-1", "Non-HDL Cholesterol", "mg/dL", ["Non HDL Cholesterol"]),
+    ("9830-1", "Total Cholesterol / HDL Ratio", "ratio", ["TC/HDL Cholesterol Ratio", "Cholesterol HDL Ratio"]),
+    ("11054-4", "LDL / HDL Ratio", "ratio", ["LDL HDL Ratio"]),
+    ("1869-7", "Apolipoprotein A1", "mg/dL", ["Apo-A1", "Apo A1"]),
+    ("1884-6", "Apolipoprotein B", "mg/dL", ["Apo-B", "Apo B"]),
+    ("1874-7", "Apolipoprotein B / A1 Ratio", "ratio", ["Apo B/A1", "Apo B / Apo A1 Ratio"]),
+    ("10835-7", "Lipoprotein (a)", "mg/dL", ["Lp(a)", "Lipoprotein a"]),
+    # Liver
+    ("1975-2", "Bilirubin Total", "mg/dL", ["Total Bilirubin", "Serum Bilirubin"]),
+    ("1968-7", "Bilirubin Direct", "mg/dL", ["Direct Bilirubin", "Conjugated Bilirubin"]),
+    ("1971-1", "Bilirubin Indirect", "mg/dL", ["Indirect Bilirubin", "Unconjugated Bilirubin"]),
+    ("1920-8", "Aspartate Aminotransferase", "U/L", ["AST", "SGOT", "SGOT (AST)"]),
+    ("1742-6", "Alanine Aminotransferase", "U/L", ["ALT", "SGPT", "SGPT (ALT)", "Alanine Transaminase"]),
+    ("2532-0", "Lactate Dehydrogenase", "U/L", ["LDH"]),
+    ("6768-6", "Alkaline Phosphatase", "U/L", ["ALP"]),
+    ("2324-2", "Gamma Glutamyl Transferase", "U/L", ["GGT", "Gamma GT", "GGTP"]),
+    ("2885-2", "Total Protein", "g/dL", ["Protein Total", "Serum Protein"]),
+    ("1751-7", "Albumin", "g/dL", ["Serum Albumin", "Albumin Serum"]),
+    ("10834-0", "Globulin", "g/dL", ["Serum Globulin"]),
+    ("1759-0", "Albumin / Globulin Ratio", "ratio", ["A/G Ratio", "Serum Alb/Globulin Ratio"]),
+    # Kidney and electrolytes
+    ("2160-0", "Creatinine", "mg/dL", ["Serum Creatinine", "Creatinine Serum"]),
+    ("3094-0", "Blood Urea Nitrogen", "mg/dL", ["BUN"]),
+    ("3091-6", "Urea", "mg/dL", ["Blood Urea", "Serum Urea"]),
+    ("3097-3", "BUN / Creatinine Ratio", "ratio", ["BUN/Sr.Creatinine Ratio", "Urea Creatinine Ratio"]),
+    ("3084-1", "Uric Acid", "mg/dL", ["Serum Uric Acid"]),
+    ("33914-3", "Estimated Glomerular Filtration Rate", "mL/min/1.73m2", ["eGFR", "Est. Glomerular Filtration Rate"]),
+    ("17861-6", "Calcium", "mg/dL", ["Serum Calcium", "Total Calcium"]),
+    ("29265-6", "Adjusted Calcium", "mg/dL", ["Corrected Calcium"]),
+    ("2777-1", "Phosphorus", "mg/dL", ["Phosphate", "Inorganic Phosphorus"]),
+    ("19123-9", "Magnesium", "mg/dL", ["Serum Magnesium"]),
+    ("2951-2", "Sodium", "mmol/L", ["Na", "Serum Sodium"]),
+    ("2823-3", "Potassium", "mmol/L", ["K", "Serum Potassium"]),
+    ("2075-0", "Chloride", "mmol/L", ["Cl", "Serum Chloride"]),
+    # Diabetes
+    ("1558-6", "Fasting Glucose", "mg/dL", ["Fasting Blood Sugar", "FBS", "Plasma Glucose (Fasting)", "Glucose Fasting"]),
+    ("1521-4", "Post Prandial Glucose", "mg/dL", ["Post Prandial Blood Sugar", "PPBS", "Glucose PP"]),
+    ("2345-7", "Random Glucose", "mg/dL", ["Random Blood Sugar", "RBS"]),
+    ("4548-4", "HbA1c", "%", ["Glycated Hemoglobin", "Glycosylated Hemoglobin", "HbA1C - Glycated Hemoglobin"]),
+    ("27353-2", "Estimated Average Glucose", "mg/dL", ["eAG", "Average Blood Glucose", "ABG"]),
+    ("20448-7", "Insulin Fasting", "uIU/mL", ["Fasting Insulin", "Insulin"]),
+    # Thyroid and hormones
+    ("3016-3", "TSH", "uIU/mL", ["Thyroid Stimulating Hormone", "TSH Ultrasensitive"]),
+    ("3053-6", "T3 Total", "ng/dL", ["T3", "Triiodothyronine", "Total T3"]),
+    ("3026-2", "T4 Total", "ug/dL", ["T4", "Thyroxine", "Total T4"]),
+    ("3051-0", "Free T3", "pg/mL", ["FT3"]),
+    ("3024-7", "Free T4", "ng/dL", ["FT4"]),
+    ("2986-8", "Testosterone", "ng/dL", ["Testosterone Total"]),
+    # Vitamins, iron, inflammation
+    ("62292-8", "Vitamin D 25-Hydroxy", "ng/mL", ["25-OH Vitamin D", "25 Hydroxyvitamin D", "Vitamin D (Total)", "Vitamin D"]),
+    ("2132-9", "Vitamin B12", "pg/mL", ["Vitamin B-12", "Cobalamin", "B12"]),
+    ("60239-1", "Active B12", "pmol/L", ["Holotranscobalamin", "Active Vitamin B12"]),
+    ("2284-8", "Folate", "ng/mL", ["Folic Acid", "Serum Folate"]),
+    ("2498-4", "Iron", "ug/dL", ["Serum Iron"]),
+    ("2500-7", "Total Iron Binding Capacity", "ug/dL", ["TIBC"]),
+    ("2502-3", "Transferrin Saturation", "%", ["% Transferrin Saturation", "TSAT"]),
+    ("2276-4", "Ferritin", "ng/mL", ["Serum Ferritin"]),
+    ("30522-7", "hs-CRP", "mg/L", ["High Sensitivity C-Reactive Protein", "HS-CRP"]),
+    ("1988-5", "C-Reactive Protein", "mg/L", ["CRP"]),
+    ("13965-9", "Homocysteine", "umol/L", ["Serum Homocysteine"]),
+]
+
+# "%" is kept as a word: "Neutrophils %" and "Neutrophils Absolute Count" style pairs differ by it
+WORD_PAT = re.compile(r"[a-z0-9]+|%")
+
+def normalize(name):
+    return " ".join(WORD_PAT.findall(name.lower()))
+
+def clean_name(name):
+    # Text-rule rows carry the whole line ("LDL Cholesterol (Direct) L 32 mg/dL <100");
+    # keep the words before the first number that follows a word
+    words = name.split()
+    for i, w in enumerate(words):
+        if i and re.fullmatch(r"[<>]?[-+]?\d+(?:[.,]\d+)?", w):
+            return " ".join(words[:i])
+    return name
+
+def ngrams(text, n=3):
+    # Word-padded character n-grams: word order and spacing noise change only a few grams
+    grams = Counter()
+    for w in text.split():
+        w = f" {w} "
+        grams.update(w[i:i + n] for i in range(max(1, len(w) - n + 1)))
+    return grams
+
+class AnalyteDictionary:
+    def __init__(self, entries=DEFAULT_ANALYTES, n=3, max_candidates=32, max_postings=256):
+        self.n = n
+        self.max_candidates = max_candidates
+        self.max_postings = max_postings  # grams in more keys than this are skipped once candidates are found
+        self.entries = []   # {"code", "name", "unit"}
+        self.keys = []      # (normalized alias, entry index, gram counts, gram total)
+        self.exact = {}     # normalized alias -> key index
+        self.index = {}     # gram -> [key index]
+        self._version = None
+        for e in entries:
+            self.add(*e)
+
+    @classmethod
+    def from_json(cls, path, extend=True, **kwargs):
+        # [{"code", "name", "unit", "aliases": [...]}]; added to (or replacing) the defaults
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        entries = [(d.get("code"), d["name"], d.get("unit"), d.get("aliases", [])) for d in data]
+        return cls((DEFAULT_ANALYTES if extend else []) + entries, **kwargs)
+
+    def add(self, code, name, unit=None, aliases=()):
+        self._version = None
+        self.entries.append({"code": code, "name": name, "unit": unit})
+        e = len(self.entries) - 1
+        for alias in [name] + list(aliases):
+            key = normalize(alias)
+            if not key or key in self.exact:
+                continue
+            grams = ngrams(key, self.n)
+            self.exact[key] = len(self.keys)
+            for g in grams:
+                self.index.setdefault(g, []).append(len(self.keys))
+            self.keys.append((key, e, grams, sum(grams.values())))
+
+    @property
+    def version(self):
+        # Part of result cache keys: edits to the dictionary invalidate cached results.
+        # Hashed once after loading (add() resets it), not on every report
+        if self._version is None:
+            h = hashlib.sha256(json.dumps(self.entries, sort_keys=True).encode())
+            h.update(json.dumps(sorted(self.exact)).encode())
+            self._version = h.hexdigest()[:12]
+        return self._version
+
+    def match(self, name, min_score=0.5):
+        # Best canonical entry for a raw name as (entry, score), or (None, best score)
+        key = normalize(clean_name(name))
+        if not key:
+            return None, 0.0
+        if key in self.exact:
+            return self.entries[self.keys[self.exact[key]][1]], 1.0
+        # The name without its bracketed part: "GLYCOSYLATED HEMOGLOBIN (HB)"
+        bare = normalize(clean_name(re.sub(r"\([^()]*\)", " ", name)))
+        if bare in self.exact:
+            return self.entries[self.keys[self.exact[bare]][1]], 1.0
+
+        # Acronym in brackets is often the most reliable part ("HEMATOCRIT(PCV)", "(HS-CRP)"), but
+        # competes with the fuzzy candidates for the full name; a full name that agrees adds to it
+        acronym = None
+        for abbr in re.findall(r"\(([^()]{2,12})\)", name):
+            k = normalize(abbr)
+            if k in self.exact and k != key:
+                acronym = self.exact[k]
+                break
+
+        grams = ngrams(key, self.n)
+        # Candidates come from the postings of the query's grams, rarest first. Once there are
+        # max_candidates of them, grams common to more than max_postings keys (" th", "in ") are
+        # not walked: they would touch much of a large dictionary and rarely decide the match.
+        shared = Counter()
+        for g in sorted(grams, key=lambda g: len(self.index.get(g, ()))):
+            postings = self.index.get(g, ())
+            if len(postings) > self.max_postings and len(shared) >= self.max_candidates:
+                break
+            for k in postings:
+                shared[k] += min(grams[g], self.keys[k][2][g])
+        best, best_score, agree = None, 0.0, 0.0
+        total = sum(grams.values())
+        for k, _ in shared.most_common(self.max_candidates):
+            # Exact overlap over all grams, including any skipped above
+            kg = self.keys[k][2]
+            score = 2.0 * sum(min(c, kg[g]) for g, c in grams.items() if g in kg) / (total + self.keys[k][3])
+            if score > best_score:
+                best, best_score = k, score
+            if acronym is not None and self.keys[k][1] == self.keys[acronym][1]:
+                agree = max(agree, score)
+        if acronym is not None and 0.9 + 0.1 * agree > best_score:
+            best, best_score = acronym, 0.9 + 0.1 * agree
+        best_score = round(best_score, 3)
+        if best is None or best_score < min_score:
+            return None, best_score
+        return self.entries[self.keys[best][1]], best_score
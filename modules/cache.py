@@ -0,0 +1,120 @@
+"""
+Module 7: Content-addressed disk cache
+Goal: Reuse extraction results and page OCR tokens for inputs we have already seen
+"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import logging
+
+logger = logging.getLogger("modules.cache")
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def content_key(*parts) -> str:
+    h = hashlib.sha256()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else str(p).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+class DiskCache:
+    # JSON values stored as <root>/<key[:2]>/<key>.json; mtime doubles as LRU clock
+    def __init__(self, root: str, max_bytes: int = 256 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._size = sum(os.path.getsize(p) for p, _ in self._entries())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _entries(self):
+        for d in os.listdir(self.root):
+            sub = os.path.join(self.root, d)
+            if not os.path.isdir(sub):
+                continue
+            for fn in os.listdir(sub):
+                if fn.endswith(".json"):
+                    p = os.path.join(sub, fn)
+                    try:
+                        yield p, os.path.getmtime(p)
+                    except FileNotFoundError:
+                        pass  # evicted by another process
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: str, count: bool = True):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)  # mark as recently used
+        except (FileNotFoundError, ValueError):
+            value = None
+        if count:
+            self.record(value is not None)
+        return value
+
+    def put(self, key: str, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp, path)  # atomic; readers never see a partial entry
+        with self._lock:
+            self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[1])
+        size = sum(os.path.getsize(p) for p, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for p, _ in entries:
+            if size <= target:
+                break
+            try:
+                n = os.path.getsize(p)
+                os.remove(p)
+                size -= n
+                removed += 1
+            except FileNotFoundError:
+                pass
+        self._size = size
+        logger.info("Evicted %d cache entries from %s", removed, self.root)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "max_bytes": self.max_bytes
+        }
@@ -0,0 +1,156 @@
+"""
+Module 14: Corrections store
+Goal: Keep HITL corrections in an append-only SQLite log with O(1) counts, atomic IDs and
+"since model version N" queries, instead of re-reading a directory of JSON files on every call
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+from contextlib import closing
+
+logger = logging.getLogger("modules.corrections_store")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS corrections (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    original TEXT NOT NULL,
+    corrected TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS corrections_id ON corrections (id, seq);
+CREATE TABLE IF NOT EXISTS trainings (
+    version INTEGER PRIMARY KEY,
+    last_seq INTEGER NOT NULL,
+    trained_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+class CorrectionsStore:
+    # Corrections are never rewritten: saving an existing id appends a newer row that
+    # supersedes the old one. `meta.count` tracks distinct ids so counting needs no scan.
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with closing(self._connect()) as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _tx(self, fn):
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            out = fn(db)
+            db.execute("COMMIT")
+            return out
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _insert(db, original, corrected, cid=None, created_at=None):
+        cur = db.execute(
+            "INSERT INTO corrections (id, original, corrected, created_at) VALUES (?, ?, ?, ?)",
+            (cid or "", json.dumps(original, ensure_ascii=False), json.dumps(corrected, ensure_ascii=False),
+             created_at or time.time()))
+        seq = cur.lastrowid
+        if not cid:
+            # Allocated inside the write transaction, so concurrent saves never collide
+            cid = f"corr_{seq:04d}"
+            db.execute("UPDATE corrections SET id = ? WHERE seq = ?", (cid, seq))
+        if db.execute("SELECT COUNT(*) FROM corrections WHERE id = ?", (cid,)).fetchone()[0] == 1:
+            db.execute("INSERT INTO meta (key, value) VALUES ('count', '1') "
+                       "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+        return cid, seq
+
+    def add(self, original, corrected, cid=None):
+        return self._tx(lambda db: self._insert(db, original, corrected, cid))[0]
+
+    def count(self) -> int:
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT value FROM meta WHERE key = 'count'").fetchone()
+        return int(row[0]) if row else 0
+
+    def last_seq(self) -> int:
+        with closing(self._connect()) as db:
+            return db.execute("SELECT COALESCE(MAX(seq), 0) FROM corrections").fetchone()[0]
+
+    def since(self, seq: int = 0):
+        # Latest version of every correction saved after `seq`, oldest first
+        with closing(self._connect()) as db:
+            rows = db.execute(
+                "SELECT * FROM corrections WHERE seq IN "
+                "(SELECT MAX(seq) FROM corrections WHERE seq > ? GROUP BY id) ORDER BY seq", (seq,)).fetchall()
+        return [self._row(r) for r in rows]
+
+    def pending_since(self, seq: int):
+        # (corrections saved after `seq`, created_at of the oldest of them or None)
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT COUNT(DISTINCT id), MIN(created_at) FROM corrections WHERE seq > ?",
+                             (seq,)).fetchone()
+        return row[0], row[1]
+
+    def get(self, cid: str):
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT * FROM corrections WHERE id = ? ORDER BY seq DESC LIMIT 1", (cid,)).fetchone()
+        return self._row(row) if row else None
+
+    @staticmethod
+    def _row(r):
+        return {"id": r["id"], "seq": r["seq"], "original": json.loads(r["original"]),
+                "corrected": json.loads(r["corrected"]), "created_at": r["created_at"]}
+
+    def record_training(self, version: int, last_seq: int):
+        self._tx(lambda db: db.execute(
+            "INSERT OR REPLACE INTO trainings (version, last_seq, trained_at) VALUES (?, ?, ?)",
+            (version, last_seq, time.time())))
+
+    def seq_for_version(self, version: int) -> int:
+        # Last correction a model version was trained on (0: untrained or unknown version)
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT last_seq FROM trainings WHERE version = ?", (version,)).fetchone()
+        return row[0] if row else 0
+
+    def since_version(self, version: int):
+        return self.since(self.seq_for_version(version))
+
+    def import_dir(self, corrections_dir: str) -> int:
+        # One-time import of legacy <id>.json files; a marker in `meta` makes reruns no-ops
+        marker = "imported:" + os.path.abspath(corrections_dir)
+
+        def fn(db):
+            if db.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                return 0
+            n = 0
+            for name in sorted(os.listdir(corrections_dir)) if os.path.isdir(corrections_dir) else []:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(corrections_dir, name)
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.warning("Skipping unreadable correction %s: %s", path, e)
+                    continue
+                self._insert(db, data.get("original", {}), data.get("corrected", {}),
+                             os.path.splitext(name)[0], os.path.getmtime(path))
+                n += 1
+            db.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (marker, str(time.time())))
+            return n
+
+        n = self._tx(fn)
+        if n:
+            logger.info("Imported %d correction file(s) from %s", n, corrections_dir)
+        return n
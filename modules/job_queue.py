@@ -0,0 +1,171 @@
+"""
+Module 10: Durable job queue
+Goal: Share OCR jobs between API and worker processes (or hosts on a shared volume) through SQLite
+"""
+import os
+import time
+import shutil
+import sqlite3
+import logging
+from contextlib import closing
+
+from modules.jobs import QueueFull
+
+logger = logging.getLogger("modules.job_queue")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    cost REAL NOT NULL,
+    pages_total INTEGER NOT NULL,
+    pages_done INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    output_file TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    profile INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+class SQLiteJobQueue:
+    # Workers hold a lease on a running job; if it expires (worker crashed) the job
+    # is handed to another worker, up to max_attempts times
+    def __init__(self, db_path: str, max_cost: float = 200.0, lease_seconds: float = 300.0, max_attempts: int = 3):
+        self.db_path = db_path
+        self.max_cost = max_cost
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with closing(self._connect()) as db:
+            db.executescript(SCHEMA)
+            # Queues created before per-job profiling existed
+            if "profile" not in [r["name"] for r in db.execute("PRAGMA table_info(jobs)")]:
+                db.execute("ALTER TABLE jobs ADD COLUMN profile INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self):
+        # One short-lived connection per call keeps this safe across threads and processes
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _tx(self, fn):
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")  # take the write lock up front
+            out = fn(db)
+            db.execute("COMMIT")
+            return out
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def enqueue(self, job_id: str, file_path: str, pages: int, cost: float, profile: bool = False):
+        def fn(db):
+            inflight = db.execute(
+                "SELECT COALESCE(SUM(cost), 0) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+            if inflight > 0 and inflight + cost > self.max_cost:
+                raise QueueFull(f"Queue full ({inflight:.0f}/{self.max_cost:.0f} cost units in flight)")
+            db.execute(
+                "INSERT INTO jobs (id, status, file_path, cost, pages_total, created_at, profile) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, file_path, cost, pages, time.time(), int(profile)))
+        self._tx(fn)
+        logger.info("Enqueued job %s (%d page(s), cost %.1f)", job_id, pages, cost)
+
+    def claim(self, worker_id: str):
+        # Oldest queued job, or a running one whose lease has lapsed; None when idle
+        def fn(db):
+            now = time.time()
+            expired = [r["file_path"] for r in db.execute(
+                "SELECT file_path FROM jobs WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts))]
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Lease expired too many times', finished_at = ? "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts))
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY created_at LIMIT 1", (now,)).fetchone()
+            if row is not None:
+                db.execute(
+                    "UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                    "pages_done = 0, started_at = ? WHERE id = ?",
+                    (worker_id, now + self.lease_seconds, now, row["id"]))
+            return (dict(row) if row is not None else None), expired
+        job, expired = self._tx(fn)
+        for path in expired:
+            # Given up on: no worker will read the spooled upload again
+            logger.warning("Job upload %s failed after %d expired leases", path, self.max_attempts)
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+        return job
+
+    def heartbeat(self, job_id: str, worker_id: str, pages_done: int = None):
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE jobs SET lease_expires = ?, pages_done = COALESCE(?, pages_done) "
+                "WHERE id = ? AND lease_owner = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, pages_done, job_id, worker_id))
+
+    def complete(self, job_id: str, worker_id: str, output_file: str):
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE jobs SET status = 'done', output_file = ?, pages_done = pages_total, finished_at = ?, "
+                "lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ?",
+                (output_file, time.time(), job_id, worker_id))
+
+    def fail(self, job_id: str, worker_id: str, error: str):
+        # Retry on another claim until max_attempts, then give up
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, error = ?, "
+                "finished_at = CASE WHEN attempts < ? THEN NULL ELSE ? END, lease_owner = NULL, lease_expires = NULL "
+                "WHERE id = ? AND lease_owner = ?",
+                (self.max_attempts, error, self.max_attempts, time.time(), job_id, worker_id))
+
+    def get(self, job_id: str):
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        out = {
+            "job_id": row["id"],
+            "status": row["status"],
+            "pages_total": row["pages_total"],
+            "pages_done": row["pages_done"],
+            "cost": round(row["cost"], 2),
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "output_file": row["output_file"],
+        }
+        if row["error"]:
+            out["error"] = row["error"]
+        return out
+
+    def count_done(self, since: float = 0.0) -> int:
+        with closing(self._connect()) as db:
+            return db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'done' AND finished_at >= ?",
+                              (since,)).fetchone()[0]
+
+    def stats(self):
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT status, COUNT(*), COALESCE(SUM(cost), 0) FROM jobs GROUP BY status").fetchall()
+        counts = {r[0]: r[1] for r in rows}
+        inflight_cost = sum(r[2] for r in rows if r[0] in ("queued", "running"))
+        return {
+            "backend": "sqlite",
+            "inflight_jobs": counts.get("queued", 0) + counts.get("running", 0),
+            "inflight_cost": round(inflight_cost, 2),
+            "max_cost": self.max_cost,
+            "jobs_by_status": counts
+        }
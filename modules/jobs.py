@@ -0,0 +1,117 @@
+"""
+Module 9: Job queue
+Goal: Accept reports as background jobs with cost-based admission control and progress tracking
+"""
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger("modules.jobs")
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    def __init__(self, job_id: str, cost: float, pages_total: int):
+        self.id = job_id
+        self.cost = cost
+        self.status = "queued"
+        self.pages_total = pages_total
+        self.pages_done = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    def progress(self, pages_done: int, pages_total: int):
+        # Called from the worker thread as pages finish
+        self.pages_done = pages_done
+        self.pages_total = pages_total
+
+    def to_dict(self, include_result: bool = True):
+        out = {
+            "job_id": self.id,
+            "status": self.status,
+            "pages_total": self.pages_total,
+            "pages_done": self.pages_done,
+            "cost": round(self.cost, 2),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.error:
+            out["error"] = self.error
+        if include_result and self.result is not None:
+            out["result"] = self.result
+        return out
+
+class JobManager:
+    def __init__(self, max_cost: float = 200.0, max_concurrent: int = 2, max_finished: int = 1000):
+        # Cost unit: one page at 300 DPI; max_cost bounds queued + running work
+        self.max_cost = max_cost
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._inflight_cost = 0.0
+        self._sem = None
+        self._tasks = set()  # strong refs so running jobs aren't garbage-collected
+
+    @staticmethod
+    def estimate_cost(pages: int, dpi: int) -> float:
+        # Render/clean/OCR time grows with pixel count, i.e. pages x DPI^2
+        return pages * (dpi / 300.0) ** 2
+
+    def inflight(self):
+        return sum(1 for j in self._jobs.values() if j.status in ("queued", "running"))
+
+    def submit(self, job_id: str, work, pages: int, dpi: int) -> Job:
+        # `work(progress)` runs in a thread and returns the result dict
+        cost = self.estimate_cost(pages, dpi)
+        # An idle service always admits one job, however large
+        if self._inflight_cost > 0 and self._inflight_cost + cost > self.max_cost:
+            raise QueueFull(f"Queue full ({self._inflight_cost:.0f}/{self.max_cost:.0f} cost units in flight)")
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrent)
+        job = Job(job_id, cost, pages)
+        self._jobs[job_id] = job
+        self._inflight_cost += cost
+        task = asyncio.create_task(self._run(job, work))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        logger.info("Queued job %s (%d page(s), cost %.1f)", job_id, pages, cost)
+        return job
+
+    async def _run(self, job: Job, work):
+        try:
+            async with self._sem:
+                job.status = "running"
+                job.started_at = time.time()
+                job.result = await asyncio.to_thread(work, job.progress)
+                job.status = "done"
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            self._inflight_cost -= job.cost
+            job.done.set()
+            self._trim()
+
+    def _trim(self):
+        finished = [jid for jid, j in self._jobs.items() if j.done.is_set()]
+        for jid in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[jid]
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id)
+
+    def stats(self):
+        return {
+            "inflight_jobs": self.inflight(),
+            "inflight_cost": round(self._inflight_cost, 2),
+            "max_cost": self.max_cost
+        }
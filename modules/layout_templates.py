@@ -0,0 +1,386 @@
+"""
+Module 19: Layout templates
+Goal: Recognize recurring report layouts (per lab) from a cheap low-resolution page signature and
+blank out their boilerplate (letterheads, address blocks, footers) before OCR. Templates are learned
+from processed pages and refined by reviewer corrections.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import logging
+import argparse
+from contextlib import closing
+
+import numpy as np
+
+from modules.lazy import LazyModule
+from modules.analyte_dictionary import normalize
+
+cv2 = LazyModule("cv2")
+
+logger = logging.getLogger("modules.layout_templates")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    label TEXT,
+    grid BLOB NOT NULL,
+    skip TEXT NOT NULL DEFAULT '[]',
+    revision INTEGER NOT NULL DEFAULT 0,
+    pages INTEGER NOT NULL DEFAULT 0,
+    docs INTEGER NOT NULL DEFAULT 0,
+    full_docs INTEGER NOT NULL DEFAULT 0,
+    lines TEXT NOT NULL DEFAULT '[]',
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Signature: the page shrunk to GRID (w, h); only the top and bottom BANDS rows (letterhead,
+# footer) are compared, since the body changes with every patient
+GRID = (48, 64)
+BANDS = (12, 6)
+
+def fingerprint(gray):
+    # Only the two bands are shrunk, not the whole page
+    if gray.ndim == 3:
+        gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY)
+    h = gray.shape[0]
+    top, bottom = gray[:h * BANDS[0] // GRID[1]], gray[h - h * BANDS[1] // GRID[1]:]
+    bands = [cv2.resize(b, (GRID[0], n), interpolation=cv2.INTER_AREA) for b, n in ((top, BANDS[0]), (bottom, BANDS[1]))]
+    return 1.0 - np.concatenate([b.ravel() for b in bands]).astype(np.float32) / 255.0
+
+def _unit(v):
+    # Zero-mean, unit-norm: a dot product of two signatures is their correlation
+    v = np.asarray(v, dtype=np.float32)
+    v = v - v.mean()
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+def page_lines(store, size, line_threshold: int = 10):
+    # [(text, box in 0..1 page coordinates, token indices)] for lines with some text
+    w, h = size
+    out = []
+    for idx in store.line_indices(line_threshold):
+        text = " ".join(store.text(int(i)) for i in idx).strip()
+        if len(normalize(text)) < 3:
+            continue
+        box = [float(store.left[idx].min()) / w, float(store.top[idx].min()) / h,
+               float(store.right[idx].max()) / w, float(store.bottom[idx].max()) / h]
+        out.append((text, box, idx))
+    return out
+
+class LayoutTemplates:
+    # A line becomes boilerplate once it has appeared, with the same text at the same place, in
+    # `ratio` of at least `min_docs` distinct documents of the template. Counting documents (not
+    # pages) keeps a report's own patient block, repeated on each of its pages, from qualifying.
+    # Lines that carried data are protected and never skipped. A `verify_rate` sample of matched
+    # pages is still OCR'd in full so the statistics keep tracking the layout.
+    def __init__(self, db_path: str, threshold: float = 0.95, min_docs: int = 3, ratio: float = 0.8,
+                 verify_rate: float = 0.05, max_templates: int = 200, pad: float = 0.004):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.min_docs = min_docs
+        self.ratio = ratio
+        self.verify_rate = verify_rate
+        self.max_templates = max_templates
+        self.pad = pad
+        self._generation = None
+        self._cache = []   # [(id, unit signature, skip boxes, revision)]
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with closing(self._connect()) as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _tx(self, fn):
+        # `fn(db)` returns (result, changed); matchers reload only when `changed` (new or removed
+        # templates, new skip regions), not for every signature/statistics update
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            out, changed = fn(db)
+            if changed:
+                db.execute("INSERT INTO meta (key, value) VALUES ('generation', '1') "
+                           "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+            db.execute("COMMIT")
+            return out
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def _refresh(self):
+        # One indexed read per page; templates are reloaded only after a change
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+            generation = row[0] if row else None
+            if generation == self._generation:
+                return
+            rows = db.execute("SELECT id, grid, skip, revision FROM templates").fetchall()
+        self._cache = [(r["id"], _unit(np.frombuffer(r["grid"], dtype=np.float32)), json.loads(r["skip"]),
+                        r["revision"]) for r in rows]
+        self._generation = generation
+
+    def __getstate__(self):
+        # Pool workers reload from the database on first use
+        state = self.__dict__.copy()
+        state["_cache"], state["_generation"] = [], None
+        return state
+
+    def _best(self, fp, cache):
+        if not cache:
+            return None, 0.0
+        scores = np.array([c[1] for c in cache]) @ _unit(fp)
+        i = int(np.argmax(scores))
+        return (cache[i], float(scores[i])) if scores[i] >= self.threshold else (None, float(scores[i]))
+
+    def match(self, gray):
+        # Decide how to OCR one rendered page: which template it is and which regions to blank out
+        fp = fingerprint(gray)
+        h, w = gray.shape[:2]
+        self._refresh()
+        t, score = self._best(fp, self._cache)
+        out = {"template": None, "score": round(score, 4), "fingerprint": fp, "size": [w, h],
+               "full": True, "skip": [], "key": None}
+        if t is None:
+            return out
+        tid, _, skip, revision = t
+        out["template"] = tid
+        out["key"] = f"{tid}:{revision}"
+        if skip and random.random() >= self.verify_rate:
+            out["full"] = False
+            out["key"] += ":masked"
+            out["skip"] = [(int(x0 * w), int(y0 * h), int(np.ceil(x1 * w)), int(np.ceil(y1 * h)))
+                           for x0, y0, x1, y1 in skip]
+        return out
+
+    def _regions(self, lines, full_docs):
+        # Padded boxes of the template's boilerplate lines
+        skip = []
+        for line in lines:
+            if line["forced"] < 0:
+                continue
+            if line["forced"] > 0 and line["seen"] >= 2 or \
+                    full_docs >= self.min_docs and line["seen"] >= self.ratio * full_docs:
+                x0, y0, x1, y1 = line["box"]
+                skip.append([round(max(0.0, x0 - self.pad), 4), round(max(0.0, y0 - self.pad), 4),
+                             round(min(1.0, x1 + self.pad), 4), round(min(1.0, y1 + self.pad), 4)])
+        return skip
+
+    @staticmethod
+    def _find_line(lines, box, text):
+        # Same text, digits included: a results row whose value changes is a different line
+        for line in lines:
+            if line["text"] == text and abs(line["box"][1] - box[1]) <= 0.01 and abs(line["box"][0] - box[0]) <= 0.02:
+                return line
+        return None
+
+    def _merge_lines(self, t, pages, protected):
+        # Count each template line at most once per document; lines that carried data are protected
+        lines, matched = t["lines"], set()
+        for page in pages:
+            keep = page.get("keep") or ()
+            for text, box, idx in page_lines(page["tokens"], page["layout"]["size"]):
+                line = self._find_line(lines, box, text)
+                if line is None:
+                    line = {"text": text, "box": [round(v, 4) for v in box], "seen": 0, "forced": 0}
+                    lines.append(line)
+                if id(line) not in matched:
+                    matched.add(id(line))
+                    line["seen"] += 1
+                    # Running average absorbs small scan offsets
+                    line["box"] = [round(a + (b - a) / line["seen"], 4) for a, b in zip(line["box"], box)]
+                if any(int(i) in keep for i in idx) or any(p in normalize(text) for p in protected):
+                    line["forced"] = -1
+        # Drop one-off lines (patient data, results) once the template has some history; a rare
+        # line is protected again by whatever protected it when it next appears
+        if t["full_docs"] >= 2 * self.min_docs:
+            t["lines"] = [l for l in lines if l["forced"] > 0 or l["seen"] >= 0.2 * t["full_docs"]]
+
+    def _load(self, db, tid):
+        r = db.execute("SELECT * FROM templates WHERE id = ?", (tid,)).fetchone()
+        if r is None:
+            return None
+        t = dict(r)
+        t["grid"] = np.frombuffer(r["grid"], dtype=np.float32).copy()
+        t["skip"], t["lines"] = json.loads(r["skip"]), json.loads(r["lines"])
+        return t
+
+    def _save(self, db, t, now):
+        # True when the skip regions changed (a new revision matchers must pick up)
+        skip = self._regions(t["lines"], t["full_docs"])
+        changed = skip != t["skip"]
+        if changed:
+            t["skip"] = skip
+            t["revision"] += 1
+            boiler = [l for l in t["lines"] if l["forced"] >= 0 and l["seen"] >= self.ratio * max(1, t["full_docs"])]
+            t["label"] = min(boiler, key=lambda l: l["box"][1])["text"][:60] if boiler else t["label"]
+        db.execute("UPDATE templates SET label = ?, grid = ?, skip = ?, revision = ?, pages = ?, docs = ?, "
+                   "full_docs = ?, lines = ?, last_used = ? WHERE id = ?",
+                   (t["label"], t["grid"].astype(np.float32).tobytes(), json.dumps(t["skip"]), t["revision"],
+                    t["pages"], t["docs"], t["full_docs"], json.dumps(t["lines"]), now, t["id"]))
+        return changed
+
+    def _create(self, db, fp, now):
+        if db.execute("SELECT COUNT(*) FROM templates").fetchone()[0] >= self.max_templates:
+            # Evict the least-used layout seen longest ago
+            db.execute("DELETE FROM templates WHERE id = (SELECT id FROM templates ORDER BY docs, last_used LIMIT 1)")
+        return db.execute("INSERT INTO templates (grid, created_at, last_used) VALUES (?, ?, ?)",
+                          (np.asarray(fp, dtype=np.float32).tobytes(), now, now)).lastrowid
+
+    def learn(self, pages, protected=()):
+        # `pages`: one document's OCR'd pages ({"layout": match(), "tokens": TokenStore, "keep": set}),
+        # where `keep` holds token indices whose lines must stay readable (the result table).
+        # `protected`: normalized strings the extraction used (patient values, recognized test names)
+        pages = [p for p in pages if p.get("layout")]
+        if not pages:
+            return {}
+        protected = [p for p in protected if len(p) >= 3]
+
+        def fn(db):
+            now, changed = time.time(), False
+            groups, cache = {}, None
+            for p in pages:
+                tid = p["layout"]["template"]
+                if tid is None or (tid not in groups and
+                                   not db.execute("SELECT 1 FROM templates WHERE id = ?", (tid,)).fetchone()):
+                    # Unmatched when OCR'd (or since evicted); an earlier page or another process
+                    # may have created its template in the meantime
+                    if cache is None:
+                        cache = [(r["id"], _unit(np.frombuffer(r["grid"], dtype=np.float32)))
+                                 for r in db.execute("SELECT id, grid FROM templates")]
+                    best, _ = self._best(p["layout"]["fingerprint"], cache)
+                    if best is None:
+                        tid = self._create(db, p["layout"]["fingerprint"], now)
+                        cache.append((tid, _unit(p["layout"]["fingerprint"])))
+                        changed = True
+                    else:
+                        tid = best[0]
+                groups.setdefault(tid, []).append(p)
+            for tid, group in groups.items():
+                t = self._load(db, tid)
+                for p in group:
+                    t["pages"] += 1
+                    t["grid"] += (p["layout"]["fingerprint"] - t["grid"]) / min(t["pages"], 50)
+                t["docs"] += 1
+                full = [p for p in group if p["layout"]["full"]]
+                if full:
+                    t["full_docs"] += 1
+                    self._merge_lines(t, full, protected)
+                changed |= self._save(db, t, now)
+            return {tid: len(group) for tid, group in groups.items()}, changed
+
+        return self._tx(fn)
+
+    def learn_correction(self, correction):
+        # Tests the reviewer deleted mark their source lines as boilerplate; kept values protect theirs.
+        # Applied to the templates named in the result metadata, or to all of them.
+        orig, corr = correction.get("original") or {}, correction.get("corrected") or {}
+        kept = {normalize(str(v)) for v in (corr.get("patient") or {}).values() if v not in ("", None)}
+        kept |= {normalize(t.get("name", "")) for t in corr.get("tests") or []}
+        kept = {k for k in kept if len(k) >= 3}
+        dropped = {normalize(t.get("name", "")) for t in orig.get("tests") or []} - kept
+        dropped = {d for d in dropped if len(d) >= 4}
+        ids = [t.get("template") for t in (orig.get("metadata") or {}).get("layout_templates") or []]
+        ids = sorted({i for i in ids if i is not None})
+        if not dropped and not kept:
+            return 0
+
+        def fn(db):
+            now, n, changed = time.time(), 0, False
+            if not ids:
+                rows = [r[0] for r in db.execute("SELECT id FROM templates")]
+            else:
+                rows = ids
+            for tid in rows:
+                t = self._load(db, tid)
+                if t is None:
+                    continue
+                m = 0
+                for line in t["lines"]:
+                    text = normalize(line["text"])
+                    if any(k in text for k in kept):
+                        m += line["forced"] != -1
+                        line["forced"] = -1
+                    elif line["forced"] == 0 and any(d in text for d in dropped):
+                        line["forced"] = 1
+                        m += 1
+                if m:
+                    changed |= self._save(db, t, now)
+                    n += m
+            return n, changed
+
+        n = self._tx(fn)
+        if n:
+            logger.info("Correction updated %d layout template line(s)", n)
+        return n
+
+    def templates(self):
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT id, label, docs, pages, revision, skip, last_used, "
+                              "json_array_length(lines) AS n_lines FROM templates ORDER BY docs DESC").fetchall()
+        return [{"id": r["id"], "label": r["label"], "docs": r["docs"], "pages": r["pages"], "lines": r["n_lines"],
+                 "skip_regions": len(json.loads(r["skip"])), "revision": r["revision"], "last_used": r["last_used"]}
+                for r in rows]
+
+    def stats(self):
+        with closing(self._connect()) as db:
+            r = db.execute("SELECT COUNT(*), COALESCE(SUM(skip != '[]'), 0), COALESCE(SUM(docs), 0) "
+                           "FROM templates").fetchone()
+        return {"templates": r[0], "with_skip_regions": r[1], "docs": r[2]}
+
+def learn_report(templates, file_path, pipeline, tables, rules=None):
+    # Seed from an original report: pages are rendered and matched exactly as at serving time,
+    # then OCR'd in full; the result table and the patient values are protected
+    pages = sorted(pipeline.iter_pages(file_path, inline=True), key=lambda p: p["page"])
+    for page, keep in zip(pages, tables.table_tokens([p["tokens"] for p in pages])):
+        page["keep"] = keep
+    protected = []
+    if rules is not None:
+        text = "\n".join(line for p in pages for line in p["tokens"].line_texts())
+        protected = [normalize(str(v)) for v in rules.extract(text)["patient"].values() if v not in ("", None)]
+    return templates.learn([p for p in pages if p["source"] == "ocr"], protected)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Layout template tools")
+    parser.add_argument("--db", default=os.path.join("data", "layouts", "templates.db"))
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("learn", help="Learn from original reports (PDF or image, one document per file)")
+    p.add_argument("reports", nargs="+")
+    p.add_argument("--poppler-path", default=None)
+    p.add_argument("--tesseract-path", default=None)
+    sub.add_parser("show", help="List templates")
+    args = parser.parse_args(argv)
+
+    templates = LayoutTemplates(args.db)
+    if args.cmd == "learn":
+        from modules.preprocessing import FilePreprocessor
+        from modules.ocr_processor import OCRProcessor
+        from modules.pipeline import PagePipeline
+        from modules.table_extractor import TableExtractor
+        from modules.rule_based_extractor import RuleBasedExtractor
+        templates.verify_rate = 1.0  # never mask while seeding
+        pipeline = PagePipeline(FilePreprocessor(poppler_path=args.poppler_path),
+                                OCRProcessor(tesseract_path=args.tesseract_path), workers=1, layouts=templates)
+        tables, rules = TableExtractor(), RuleBasedExtractor()
+        for path in args.reports:
+            print(f"{path}: {learn_report(templates, path, pipeline, tables, rules)}")
+    for t in templates.templates():
+        print(f"#{t['id']:<4} docs={t['docs']:<5} pages={t['pages']:<5} skip={t['skip_regions']:<3} "
+              f"rev={t['revision']:<3} {t['label'] or ''}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
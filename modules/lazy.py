@@ -0,0 +1,29 @@
+"""
+Module 18: Lazy imports
+Goal: Keep importing the API cheap by deferring heavy libraries (OpenCV, pytesseract, PIL) until
+first use; warm-up code calls load() to pay for them up front, e.g. before forking workers
+"""
+import importlib
+
+class LazyModule:
+    # Stands in for a module; the real import happens on the first attribute access
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        if attr in ("_name", "_module"):  # not set yet (copy/pickle probing a bare instance)
+            raise AttributeError(attr)
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}{'' if self._module is None else ' (loaded)'}>"
@@ -0,0 +1,129 @@
+"""
+Module 16: Metrics
+Goal: In-memory counters, gauges and latency histograms, rendered in the Prometheus text format
+"""
+import bisect
+import threading
+
+# Seconds; covers sub-millisecond extraction stages up to multi-minute documents
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _labels(names, values):
+    if not names:
+        return ""
+    parts = []
+    for n, v in zip(names, values):
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{n}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+def _num(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_, labelnames=()):
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def total(self):
+        return sum(self._values.values())
+
+    def render(self):
+        return [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in sorted(self._values.items())]
+
+class Gauge(Counter):
+    # Set directly, or computed at scrape time by `fn` (returning {label tuple: value} or a number)
+    kind = "gauge"
+
+    def __init__(self, name, help_, labelnames=(), fn=None):
+        super().__init__(name, help_, labelnames)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        if self.fn is not None:
+            v = self.fn()
+            self._values = v if isinstance(v, dict) else {(): v}
+        return super().render()
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            h = self._values.get(key)
+            if h is None:
+                h = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            h["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            h["sum"] += value
+            h["count"] += 1
+
+    def snapshot(self, **labels):
+        h = self._values.get(self._key(labels))
+        return {"count": h["count"], "sum": h["sum"]} if h else {"count": 0, "sum": 0.0}
+
+    def render(self):
+        lines = []
+        for key, h in sorted(self._values.items()):
+            cum = 0
+            for le, c in zip(self.buckets + (float("inf"),), h["counts"]):
+                cum += c
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + (_num(le),))} {cum}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_num(h['sum'])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {h['count']}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_, labelnames=()):
+        return self._add(Counter(name, help_, labelnames))
+
+    def gauge(self, name, help_, labelnames=(), fn=None):
+        return self._add(Gauge(name, help_, labelnames, fn))
+
+    def histogram(self, name, help_, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for m in self._metrics.values():
+            lines += m.header() + m.render()
+        return "\n".join(lines) + "\n"
@@ -3,89 +3,281 @@ Module 5: Simple ML + HITL + enhanced extraction
 Trains simple text classifiers from corrections and blends confidences
 """
 import os
-import json
+import re
+import copy
+import math
+import time
 import pickle
+import threading
 from collections import defaultdict
 
+import numpy as np
+
+from modules.corrections_store import CorrectionsStore
+
+def _norm(s):
+    return " ".join(re.findall(r"[a-z0-9.]+", str(s).lower()))
+
+class FieldScorer:
+    # Logistic model over hashed character n-grams of "field: value" and "test: name | unit"
+    # strings. Labels come from corrections: a candidate the reviewer kept is 1, one they
+    # changed or dropped is 0. Log loss makes predict_proba a calibrated P(correct).
+    def __init__(self, n_features=2 ** 18, min_samples=20):
+        # scikit-learn is imported on first fit/predict, not when an empty scorer is built
+        self.n_features = n_features
+        self.model = None
+        self.min_samples = min_samples
+        self.counts = [0, 0]  # negatives, positives seen
+        self._vectorizer = None
+
+    @property
+    def vectorizer(self):
+        # Stateless, so never pickled; rebuilt on first use
+        if self._vectorizer is None:
+            from sklearn.feature_extraction.text import HashingVectorizer
+            self._vectorizer = HashingVectorizer(analyzer="char_wb", ngram_range=(2, 4),
+                                                 n_features=self.n_features, alternate_sign=False, norm="l2")
+        return self._vectorizer
+
+    @property
+    def ready(self):
+        return min(self.counts) > 0 and sum(self.counts) >= self.min_samples
+
+    @staticmethod
+    def field_text(field, value):
+        return f"{field}: {_norm(value)}"
+
+    @staticmethod
+    def test_text(t):
+        v = t.get("value")
+        mag = f"1e{int(math.floor(math.log10(abs(v))))}" if isinstance(v, (int, float)) and v else "0"
+        return f"test: {_norm(t.get('name', ''))} | {_norm(t.get('unit') or '')} | {mag}"
+
+    @classmethod
+    def examples(cls, correction):
+        orig, corr = correction.get("original") or {}, correction.get("corrected") or {}
+        texts, labels = [], []
+        op, cp = orig.get("patient") or {}, corr.get("patient") or {}
+        for k, v in op.items():
+            if v in ("", None):
+                continue
+            texts.append(cls.field_text(k, v))
+            labels.append(int(k in cp and _norm(cp[k]) == _norm(v)))
+        for k, v in cp.items():
+            if v not in ("", None) and _norm(op.get(k, "")) != _norm(v):
+                texts.append(cls.field_text(k, v))
+                labels.append(1)
+        kept = [(_norm(t.get("name", "")), t.get("value")) for t in corr.get("tests") or []]
+        for t in orig.get("tests") or []:
+            name, value = _norm(t.get("name", "")), t.get("value")
+            texts.append(cls.test_text(t))
+            labels.append(int(any(value == v and n and n in name for n, v in kept)))
+        for t in corr.get("tests") or []:
+            texts.append(cls.test_text(t))
+            labels.append(1)
+        return texts, labels
+
+    def partial_fit(self, corrections, epochs=3):
+        texts, labels = [], []
+        for c in corrections:
+            t, l = self.examples(c)
+            texts += t
+            labels += l
+        if not texts:
+            return 0
+        X, y = self.vectorizer.transform(texts), np.array(labels)
+        if self.model is None:
+            from sklearn.linear_model import SGDClassifier
+            self.model = SGDClassifier(loss="log_loss", alpha=1e-4, random_state=0)
+        for _ in range(epochs):
+            self.model.partial_fit(X, y, classes=np.array([0, 1]))
+        self.counts[0] += int((y == 0).sum())
+        self.counts[1] += int((y == 1).sum())
+        return len(texts)
+
+    def predict(self, texts):
+        # One sparse transform + one matrix-vector product for the whole report
+        if not texts:
+            return np.zeros(0)
+        return self.model.predict_proba(self.vectorizer.transform(texts))[:, 1]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_vectorizer"] = None
+        return state
+
+    def __setstate__(self, state):
+        # Older pickles carry n_features but no _vectorizer
+        self.__dict__.update(state)
+        self._vectorizer = None
+
 class SimpleMLExtractor:
-    def __init__(self, model_dir="models"):
+    CURRENT = "field_classifiers.current"  # names the live versioned model file
+
+    def __init__(self, model_dir="models", keep_versions=5):
         self.model_dir = model_dir
+        self.keep_versions = keep_versions
         os.makedirs(self.model_dir, exist_ok=True)
         self.field_classifiers = {}  # stub: field -> set of seen strings
+        self.scorer = FieldScorer()  # learned scorer for patient fields and test rows
         self.is_trained = False
+        self.version = 0  # bumped on every train; part of result cache keys
+        self._lock = threading.Lock()  # one train at a time; readers never take it
+        self._current_mtime = None
+
+    def _model_path(self, version):
+        return os.path.join(self.model_dir, f"field_classifiers_v{version:05d}.pkl")
+
+    def _current_path(self):
+        # Versioned file named by the pointer, else the legacy single-file model
+        pointer = os.path.join(self.model_dir, self.CURRENT)
+        if os.path.exists(pointer):
+            with open(pointer, "r", encoding="utf-8") as f:
+                return os.path.join(self.model_dir, f.read().strip())
+        return os.path.join(self.model_dir, "field_classifiers.pkl")
 
     def load_models(self):
-        path = os.path.join(self.model_dir, "field_classifiers.pkl")
+        path = self._current_path()
+        pointer = os.path.join(self.model_dir, self.CURRENT)
+        self._current_mtime = os.path.getmtime(pointer) if os.path.exists(pointer) else None
         if os.path.exists(path):
             with open(path, "rb") as f:
                 obj = pickle.load(f)
-            self.field_classifiers = obj.get("field_classifiers", {})
-            self.is_trained = bool(self.field_classifiers)
+            self._swap(obj.get("field_classifiers", {}), obj.get("version", 0), obj.get("scorer") or FieldScorer())
         else:
             self.is_trained = False
 
-    def save_models(self):
-        path = os.path.join(self.model_dir, "field_classifiers.pkl")
-        with open(path, "wb") as f:
-            pickle.dump({"field_classifiers": self.field_classifiers}, f)
+    def warm_up(self):
+        # Load the live model (importing scikit-learn if it has a trained scorer) and run one prediction
+        self.load_models()
+        if self.scorer.ready:
+            self.scorer.predict(["warm up"])
+        return {"model_version": self.version, "trained": self.is_trained}
 
-    def train(self, corrections):
-        field_memory = defaultdict(set)
-        for c in corrections:
-            corr = c.get("corrected", {})
-            patient = corr.get("patient", {})
-            for k, v in patient.items():
-                if isinstance(v, str) and v.strip():
-                    field_memory[k].add(v.strip().lower())
-        self.field_classifiers = {k: set(vs) for k, vs in field_memory.items()}
-        self.is_trained = True
-        self.save_models()
+    def refresh(self):
+        # Pick up a model trained by another process (e.g. the API, seen from a queue worker)
+        pointer = os.path.join(self.model_dir, self.CURRENT)
+        try:
+            mtime = os.path.getmtime(pointer)
+        except OSError:
+            return False
+        if mtime == self._current_mtime:
+            return False
+        self.load_models()
+        return True
+
+    def _swap(self, field_classifiers, version, scorer):
+        # Rebinding attributes is atomic: in-flight scoring sees the old or the new model, never a mix
+        self.scorer = scorer
+        self.field_classifiers = field_classifiers
+        self.is_trained = bool(field_classifiers)
+        self.version = version
+
+    def save_models(self, field_classifiers=None, version=None, scorer=None):
+        # Write-then-rename so readers (and other processes) never see a partial file
+        field_classifiers = self.field_classifiers if field_classifiers is None else field_classifiers
+        version = self.version if version is None else version
+        scorer = self.scorer if scorer is None else scorer
+        path = self._model_path(version)
+        self._atomic_write(path, pickle.dumps({"field_classifiers": field_classifiers, "version": version,
+                                               "scorer": scorer}))
+        self._atomic_write(os.path.join(self.model_dir, self.CURRENT), os.path.basename(path).encode())
+        for old in sorted(f for f in os.listdir(self.model_dir)
+                          if f.startswith("field_classifiers_v") and f.endswith(".pkl"))[:-self.keep_versions]:
+            os.remove(os.path.join(self.model_dir, old))
+
+    @staticmethod
+    def _atomic_write(path, data):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def train(self, corrections, incremental=False):
+        # incremental: fold new corrections into a copy of the current memory instead of rebuilding it
+        with self._lock:
+            base = self.field_classifiers if incremental else {}
+            field_memory = defaultdict(set, {k: set(vs) for k, vs in base.items()})
+            for c in corrections:
+                corr = c.get("corrected", {})
+                patient = corr.get("patient", {})
+                for k, v in patient.items():
+                    if isinstance(v, str) and v.strip():
+                        field_memory[k].add(v.strip().lower())
+            trained = dict(field_memory)
+            # SGD continues from the live weights on a copy, so scoring is never blocked
+            scorer = copy.deepcopy(self.scorer) if incremental else FieldScorer()
+            scorer.partial_fit(corrections)
+            version = self.version + 1
+            self.save_models(trained, version, scorer)
+            self._current_mtime = os.path.getmtime(os.path.join(self.model_dir, self.CURRENT))
+            self._swap(trained, version, scorer)
         # Return trivial "scores"
-        return {k: len(v) for k, v in self.field_classifiers.items()}
+        return {k: len(v) for k, v in trained.items()}
 
     def score_patient_field(self, field_name, value):
-        if not self.is_trained:
-            return 0.0
-        if not isinstance(value, str):
-            return 0.0
-        mem = self.field_classifiers.get(field_name, set())
-        return 1.0 if value.strip().lower() in mem else 0.5 if mem else 0.0
+        return self.score_batch({field_name: value}, [])[0].get(field_name, 0.0)
+
+    def score_batch(self, patient, tests):
+        # All patient fields and test rows of a report in one vectorized call:
+        # ({field: score}, [score per test]); test scores are None until the scorer is trained
+        scorer, memory = self.scorer, self.field_classifiers
+        fields = list(patient)
+        if scorer.ready:
+            texts = [FieldScorer.field_text(k, patient[k]) for k in fields] + [FieldScorer.test_text(t) for t in tests]
+            probs = np.round(scorer.predict(texts), 3).tolist()
+            return dict(zip(fields, probs[:len(fields)])), probs[len(fields):]
+        # Fallback: exact-match memory of corrected values
+        scores = {}
+        for k in fields:
+            mem = memory.get(k, set())
+            v = patient[k]
+            scores[k] = 0.0 if not self.is_trained or not isinstance(v, str) else \
+                1.0 if v.strip().lower() in mem else 0.5 if mem else 0.0
+        return scores, [None] * len(tests)
 
 class HITLManager:
-    def __init__(self, corrections_dir="data/corrections"):
+    def __init__(self, corrections_dir="data/corrections", db_path=None):
         self.corrections_dir = corrections_dir
         os.makedirs(self.corrections_dir, exist_ok=True)
+        self.store = CorrectionsStore(db_path or os.path.join(corrections_dir, "corrections.db"))
+        self.store.import_dir(self.corrections_dir)
 
     def save_correction(self, original, corrected, report_id=None):
-        rid = report_id or f"corr_{len(os.listdir(self.corrections_dir))+1:04d}"
-        path = os.path.join(self.corrections_dir, f"{rid}.json")
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump({"original": original, "corrected": corrected}, f, indent=2, ensure_ascii=False)
-        return rid
+        return self.store.add(original, corrected, report_id)
+
+    def count(self):
+        return self.store.count()
 
     def get_training_data(self):
-        data = []
-        for fn in os.listdir(self.corrections_dir):
-            if not fn.endswith(".json"): continue
-            with open(os.path.join(self.corrections_dir, fn), "r", encoding="utf-8") as f:
-                data.append(json.load(f))
-        return data
+        return self.store.since(0)
+
+    def corrections_since(self, model_version):
+        # Corrections the given model version has not been trained on yet
+        return self.store.since_version(model_version)
 
 class EnhancedExtractor:
-    def __init__(self, rule_extractor, ml_extractor, hitl_manager):
+    def __init__(self, rule_extractor, ml_extractor, hitl_manager, dictionary=None):
         self.rule = rule_extractor
         self.ml = ml_extractor
         self.hitl = hitl_manager
+        self.dictionary = dictionary  # AnalyteDictionary for canonical test names
 
-    def extract_with_ml_enhancement(self, text: str):
+    def extract_with_ml_enhancement(self, text: str, table_rows=None, timings=None):
+        # `timings` (optional dict) receives seconds spent in "rules" and "ml"
+        t0 = time.perf_counter()
         base = self.rule.extract(text)
+        t1 = time.perf_counter()
         patient = base.get("patient", {})
-        tests = base.get("tests", [])
+        # Rows read from the page layout beat per-line guesses from flattened text
+        tests = table_rows if table_rows else base.get("tests", [])
         conf_scores = {"patient": {}}
 
+        ml_patient, ml_tests = self.ml.score_batch(patient, tests)
+
         # Blend confidences for patient fields
         for k, v in list(patient.items()):
-            ml_score = self.ml.score_patient_field(k, v) if isinstance(v, str) else 0.0
+            ml_score = ml_patient.get(k, 0.0)
             # Combine: 60% rule baseline, 40% ML
             rule_score = 0.6
             combined = 0.6 * rule_score + 0.4 * ml_score
@@ -96,11 +288,34 @@ class EnhancedExtractor:
             if c < 0.7:
                 needs_review.append(f"patient.{k}")
 
-        # Keep rule confidences for tests; could add ML later
+        for i, t in enumerate(tests):
+            conf = t.get("confidence", 0.6)
+            # Canonical test names: the match score confirms (or casts doubt on) the row
+            entry = None
+            if self.dictionary is not None:
+                entry, score = self.dictionary.match(t.get("name", ""))
+                t["match_score"] = score
+                if entry is not None:
+                    t["canonical_name"] = entry["name"]
+                    t["code"] = entry["code"]
+                    if not t.get("unit") and entry["unit"]:
+                        t["default_unit"] = entry["unit"]
+                conf = 0.7 * conf + 0.3 * score
+            if ml_tests[i] is not None:
+                t["ml_score"] = ml_tests[i]
+                conf = 0.7 * conf + 0.3 * ml_tests[i]
+            t["confidence"] = round(conf, 3)
+            if (self.dictionary is not None and entry is None) or t["confidence"] < 0.7:
+                needs_review.append(f"tests.{i}")
+
+        if timings is not None:
+            timings["rules"] = timings.get("rules", 0.0) + t1 - t0
+            timings["ml"] = timings.get("ml", 0.0) + time.perf_counter() - t1
         out = {
             "patient": patient,
             "tests": tests,
             "confidence_scores": conf_scores,
-            "needs_review": needs_review
+            "needs_review": needs_review,
+            "tests_source": "table" if table_rows else "text"
         }
         return out
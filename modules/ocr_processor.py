@@ -2,76 +2,174 @@
 Module 2: OCR & Tokenization
 Goal: Read text and get each word with its position
 """
-import pytesseract
-from PIL import Image
 import json
 import os
 import logging
 
+from modules.lazy import LazyModule
+from modules.token_store import TokenStore
+
+pytesseract = LazyModule("pytesseract")
+Image = LazyModule("PIL.Image")
+
 logger = logging.getLogger("modules.ocr_processor")
 
 class OCRProcessor:
-    def __init__(self, tesseract_path: str = None):
-        if tesseract_path:
-            pytesseract.pytesseract.tesseract_cmd = tesseract_path
-        else:
+    def __init__(self, tesseract_path: str = None, two_pass: bool = False, low_scale: float = 0.5,
+                 recheck_conf: int = 60, token_format: str = "json", max_regions: int = 8,
+                 max_region_area: float = 0.4):
+        # Nothing is imported or probed here; warm_up() (or the first OCR call) does that
+        if not tesseract_path:
             default_path = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-            if os.path.exists(default_path):
-                pytesseract.pytesseract.tesseract_cmd = default_path
-        # Validate availability
-        pytesseract.get_tesseract_version()
-        logger.info("Tesseract OCR initialized successfully")
+            tesseract_path = default_path if os.path.exists(default_path) else None
+        # Two-pass mode: OCR at low_scale, then re-OCR only lines with words below
+        # recheck_conf from the full-resolution image
+        self.two_pass = two_pass
+        self.low_scale = low_scale
+        self.recheck_conf = recheck_conf
+        # Each region is its own tesseract run; past max_regions or max_region_area (fraction of
+        # the page) one full-resolution pass over the whole page is cheaper
+        self.max_regions = max_regions
+        self.max_region_area = max_region_area
+        # Persisted token artifacts: "json" (tokens_*.json) or "binary" (memory-mappable tokens_*.tokens)
+        self.token_format = token_format
+        self.tesseract_path = tesseract_path
+        self.version = None
+        self._configured = False
 
-    def extract_text_with_positions(self, image_path: str, output_dir: str):
-        os.makedirs(output_dir, exist_ok=True)
-        image = Image.open(image_path)
-        data = pytesseract.image_to_data(
+    def _tesseract(self):
+        # Point pytesseract at our binary once per process (pool workers unpickle a fresh copy)
+        if not self._configured:
+            if self.tesseract_path:
+                pytesseract.pytesseract.tesseract_cmd = self.tesseract_path
+            self._configured = True
+        return pytesseract
+
+    def warm_up(self):
+        # Import pytesseract/PIL and check the binary runs; raises if tesseract is unavailable
+        if self.version is None:
+            self.version = str(self._tesseract().get_tesseract_version())
+            logger.info("Tesseract OCR initialized successfully (%s)", self.version)
+        return {"tesseract": self.version}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_configured"] = False
+        return state
+
+    def extract_text_with_positions(self, image_path, output_dir: str = None, page_path: str = None, skip=None):
+        # `image_path` may also be an in-memory ndarray, named by `page_path`;
+        # tokens are only written to disk when an `output_dir` is given.
+        # `skip`: pixel boxes (x0, y0, x1, y1) of known boilerplate, blanked out before OCR
+        if isinstance(image_path, str):
+            image = Image.open(image_path)
+        else:
+            image = Image.fromarray(image_path)
+            image_path = page_path
+        if skip:
+            image = image.convert("L")  # also a copy, so the caller's array is untouched
+            for box in skip:
+                image.paste(255, box)
+        if self.two_pass:
+            words, regions, calls = self._two_pass(image)
+        else:
+            words, regions, calls = self._read_words(image), [], 1
+        tokens = [w for w, _ in words if w["confidence"] > 30 and not (skip and self._inside(w, skip))]
+        out = self.save_tokens(tokens, image_path, output_dir)
+        out["skipped_regions"] = len(skip or ())
+        out["recheck_regions"] = len(regions)
+        out["tesseract_calls"] = calls  # one subprocess per image_to_data call
+        return out
+
+    def _read_words(self, image, scale: float = 1.0, offset=(0, 0)):
+        # [(token, line_key)] for every non-empty word, in full-resolution page coordinates
+        data = self._tesseract().image_to_data(
             image,
             output_type=pytesseract.Output.DICT,
             config="--psm 6"
         )
-        tokens = []
+        words = []
         for i in range(len(data["text"])):
             txt = data["text"][i].strip()
             try:
                 conf = int(float(data["conf"][i]))
             except Exception:
                 conf = -1
-            if txt and conf > 30:
-                left = int(data["left"][i]); top = int(data["top"][i])
-                width = int(data["width"][i]); height = int(data["height"][i])
-                tokens.append({
+            if txt:
+                left = int(data["left"][i] / scale) + offset[0]; top = int(data["top"][i] / scale) + offset[1]
+                width = int(data["width"][i] / scale); height = int(data["height"][i] / scale)
+                words.append(({
                     "text": txt,
                     "left": left, "top": top,
                     "width": width, "height": height,
                     "right": left + width, "bottom": top + height,
                     "confidence": conf
-                })
+                }, (data["block_num"][i], data["par_num"][i], data["line_num"][i])))
+        return words
+
+    def _two_pass(self, image):
+        w, h = image.size
+        small = image.resize((max(1, int(w * self.low_scale)), max(1, int(h * self.low_scale))),
+                             Image.Resampling.BOX)
+        words = self._read_words(small, scale=self.low_scale)
+        regions = self._weak_regions(words, w, h)
+        area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions)
+        if len(regions) > self.max_regions or area > self.max_region_area * w * h:
+            # Too noisy to patch line by line: one full-resolution read of the page instead
+            return self._read_words(image), [], 2
+        # Full-resolution reads supersede anything the first pass found inside a region
+        kept = [(t, k) for t, k in words if not self._inside(t, regions)]
+        for x0, y0, x1, y1 in regions:
+            kept.extend(self._read_words(image.crop((x0, y0, x1, y1)), offset=(x0, y0)))
+        return kept, regions, 1 + len(regions)
+
+    def _weak_regions(self, words, width, height):
+        # One padded box per text line holding low-confidence words; overlapping boxes merged
+        boxes = {}
+        for t, key in words:
+            if t["confidence"] >= self.recheck_conf:
+                continue
+            b = boxes.get(key)
+            boxes[key] = (t["left"], t["top"], t["right"], t["bottom"]) if b is None else (
+                min(b[0], t["left"]), min(b[1], t["top"]), max(b[2], t["right"]), max(b[3], t["bottom"]))
+        regions = []
+        for x0, y0, x1, y1 in sorted(boxes.values(), key=lambda b: (b[1], b[0])):
+            pad = max(8, int((y1 - y0) * 0.3))
+            r = [max(0, x0 - pad), max(0, y0 - pad), min(width, x1 + pad), min(height, y1 + pad)]
+            for m in regions:
+                if r[0] < m[2] and m[0] < r[2] and r[1] < m[3] and m[1] < r[3]:
+                    m[:] = [min(m[0], r[0]), min(m[1], r[1]), max(m[2], r[2]), max(m[3], r[3])]
+                    break
+            else:
+                regions.append(r)
+        return [tuple(r) for r in regions]
+
+    @staticmethod
+    def _inside(token, regions):
+        cx = (token["left"] + token["right"]) / 2.0
+        cy = (token["top"] + token["bottom"]) / 2.0
+        return any(x0 <= cx <= x1 and y0 <= cy <= y1 for x0, y0, x1, y1 in regions)
+
+    def save_tokens(self, tokens, image_path: str, output_dir: str = None):
+        # Shared by OCR and the PDF text-layer fast path so both produce the same artifact
         tokens.sort(key=lambda x: (x["top"], x["left"]))
-        page_name = os.path.splitext(os.path.basename(image_path))[0]
         out = {"image_path": image_path, "tokens": tokens, "total_tokens": len(tokens)}
+        if output_dir is None:
+            return out
+        # Named after the page only when written; in-memory pages may have no path at all
+        page_name = os.path.splitext(os.path.basename(image_path))[0]
+        os.makedirs(output_dir, exist_ok=True)
+        if self.token_format == "binary":
+            TokenStore.from_dicts(tokens).save(os.path.join(output_dir, f"tokens_{page_name}.tokens"), image_path)
+            return out
         with open(os.path.join(output_dir, f"tokens_{page_name}.json"), "w", encoding="utf-8") as f:
             json.dump(out, f, indent=2, ensure_ascii=False)
         return out
 
     def extract_lines(self, tokens, line_threshold: int = 10):
-        if not tokens:
-            return []
-        lines = []
-        current = [tokens[0]]
-        current_y = tokens[0]["top"]
-        for t in tokens[1:]:
-            if abs(t["top"] - current_y) <= line_threshold:
-                current.append(t)
-            else:
-                current.sort(key=lambda x: x["left"])
-                lines.append(current)
-                current = [t]
-                current_y = t["top"]
-        if current:
-            current.sort(key=lambda x: x["left"])
-            lines.append(current)
-        return lines
+        # Accepts token dicts or a TokenStore; returns lines as lists of token dicts
+        store = TokenStore.from_dicts(tokens)
+        return [store.to_dicts(idx) for idx in store.line_indices(line_threshold)]
 
     def get_line_text(self, line_tokens):
         return " ".join(t["text"] for t in line_tokens)
@@ -0,0 +1,131 @@
+"""
+Module 6: Page pipeline
+Goal: Clean and OCR the pages of a report in parallel worker processes
+"""
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from modules.cache import content_key
+from modules.token_store import TokenStore
+
+logger = logging.getLogger("modules.pipeline")
+
+# Bump when cleaning/OCR changes so cached page tokens and results are not reused
+PIPELINE_VERSION = "2"
+
+# Per-process components, set by the pool initializer
+_worker = {}
+
+def _init_worker(components):
+    _worker.update(components)
+
+def _process_page(c, file_path, page_no, output_dir=None):
+    # With no output_dir the page stays in memory: no cleaned PNG, no tokens JSON
+    preprocessor, ocr_processor, page_cache = c["preprocessor"], c["ocr"], c.get("page_cache")
+    page_path = preprocessor.page_output_path(file_path, page_no, output_dir or "")
+    timings = {}
+    t0 = time.perf_counter()
+    tokens = preprocessor.extract_text_layer(file_path, page_no)
+    timings["text_layer"] = time.perf_counter() - t0
+    if tokens is not None:
+        o = ocr_processor.save_tokens(tokens, page_path, output_dir)
+        return {"page": page_no, "image_path": None, "source": "text_layer",
+                "tokens": TokenStore.from_dicts(o["tokens"]), "timings": timings}
+
+    t0 = time.perf_counter()
+    _, img = next(preprocessor.iter_pages(file_path, page_no, page_no))
+    timings["rasterize"] = time.perf_counter() - t0
+    layout = None
+    if c.get("layouts") is not None:
+        # Known lab layout: its boilerplate regions are blanked out before OCR
+        t0 = time.perf_counter()
+        layout = c["layouts"].match(img)
+        timings["layout"] = time.perf_counter() - t0
+    key = None
+    if page_cache is not None:
+        # Keyed by the rendered pixels, so repeated letterheads/cover pages hit across documents
+        # (plus the template decision, since blanked regions change the tokens)
+        parts = [PIPELINE_VERSION, preprocessor.dpi, ocr_processor.two_pass, img.shape, img.tobytes()]
+        key = content_key(*parts, *([layout["key"]] if layout and layout["key"] else []))
+        cached = page_cache.get(key, count=False)
+        if cached is not None:
+            o = ocr_processor.save_tokens(cached, page_path, output_dir)
+            return {"page": page_no, "image_path": None, "source": "page_cache",
+                    "tokens": TokenStore.from_dicts(o["tokens"]), "timings": timings, "layout": layout}
+
+    t0 = time.perf_counter()
+    decisions = {}
+    if output_dir:
+        cleaned = preprocessor.save_cleaned_page(img, file_path, page_no, output_dir, decisions)
+    else:
+        cleaned = preprocessor.clean_array(img, decisions)
+    timings["clean"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    o = ocr_processor.extract_text_with_positions(cleaned, output_dir, page_path=page_path,
+                                                  skip=layout["skip"] if layout else None)
+    timings["ocr"] = time.perf_counter() - t0
+    if key is not None:
+        page_cache.put(key, o["tokens"])
+    return {"page": page_no, "image_path": page_path if output_dir else None, "source": "ocr",
+            "tokens": TokenStore.from_dicts(o["tokens"]), "timings": timings, "preprocessing": decisions,
+            "recheck_regions": o["recheck_regions"], "tesseract_calls": o["tesseract_calls"], "layout": layout}
+
+def _pool_task(file_path, page_no, output_dir):
+    return _process_page(_worker, file_path, page_no, output_dir)
+
+class PagePipeline:
+    def __init__(self, preprocessor, ocr_processor, workers=None, page_cache=None, layouts=None):
+        if workers is None:
+            workers = int(os.environ.get("OCR_WORKERS", os.cpu_count() or 1))
+        self.preprocessor = preprocessor
+        self.ocr = ocr_processor
+        self.page_cache = page_cache
+        self.components = {"preprocessor": preprocessor, "ocr": ocr_processor, "page_cache": page_cache,
+                           "layouts": layouts}
+        self.workers = max(1, workers)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        # Jobs start on several threads; only one of them may create the pool
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=_init_worker,
+                    initargs=(self.components,),
+                )
+                logger.info("Started OCR pool with %d worker(s)", self.workers)
+            return self._pool
+
+    def iter_pages(self, file_path: str, output_dir: str = None, count: int = None, inline: bool = False):
+        # Yields page results as they finish (completion order, not page order);
+        # `inline` keeps the work in the calling thread (e.g. so a profiler sees it)
+        count = count or self.preprocessor.page_count(file_path)
+        if inline or self.workers == 1 or count == 1:
+            pages = (_process_page(self.components, file_path, n, output_dir) for n in range(1, count + 1))
+        else:
+            pool = self._get_pool()
+            futures = [pool.submit(_pool_task, file_path, n, output_dir) for n in range(1, count + 1)]
+            pages = (f.result() for f in as_completed(futures))
+        for p in pages:
+            if self.page_cache is not None and p["source"] != "text_layer":
+                self.page_cache.record(p["source"] == "page_cache")
+            yield p
+
+    @staticmethod
+    def sum_timings(pages, wall):
+        timings = {"pages_wall": wall}
+        for p in pages:
+            for stage, secs in p["timings"].items():
+                timings[stage] = timings.get(stage, 0.0) + secs
+        return timings
+
+    def shutdown(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
@@ -2,20 +2,49 @@
 Module 1: File Input & Preprocessing
 Goal: Get a clean image from any PDF/photo so OCR works well
 """
-import cv2
 import numpy as np
-from pdf2image import convert_from_path
 import os
+import re
+import html
+import subprocess
 import logging
 
+from modules.lazy import LazyModule
+
+cv2 = LazyModule("cv2")
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logger = logging.getLogger("modules.preprocessing")
 
+# pdf2image (and PIL behind it) is imported on first use
+def convert_from_path(*args, **kwargs):
+    from pdf2image import convert_from_path as convert
+    return convert(*args, **kwargs)
+
+def pdfinfo_from_path(*args, **kwargs):
+    from pdf2image import pdfinfo_from_path as pdfinfo
+    return pdfinfo(*args, **kwargs)
+
 class FilePreprocessor:
-    def __init__(self, dpi=300, poppler_path=None):
+    WORD_PAT = re.compile(
+        r'<word xMin="([\d.]+)" yMin="([\d.]+)" xMax="([\d.]+)" yMax="([\d.]+)">(.*?)</word>', re.S)
+
+    NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], np.float32)
+
+    def __init__(self, dpi=300, poppler_path=None, render_window=1, use_text_layer=True, min_text_words=10,
+                 adaptive=True, noise_threshold=3.0, analysis_size=1200):
         self.dpi = dpi
         self.poppler_path = poppler_path
+        # Pages rendered per poppler call; peak memory is ~render_window pages
+        self.render_window = max(1, render_window)
+        # Born-digital PDFs: read words from the embedded text layer instead of OCR
+        self.use_text_layer = use_text_layer
+        self.min_text_words = min_text_words
+        # Skip denoise/deskew/binarize on pages whose quality estimate says they are not needed
+        self.adaptive = adaptive
+        self.noise_threshold = noise_threshold
+        self.analysis_size = analysis_size
 
     def process_file(self, file_path: str, output_dir: str):
         ext = file_path.lower().split(".")[-1]
@@ -26,24 +55,94 @@ class FilePreprocessor:
             return [self._process_image(file_path, output_dir)]
         raise ValueError(f"Unsupported file format: {ext}")
 
-    def _process_pdf(self, pdf_path, output_dir):
-        kwargs = {"dpi": self.dpi}
+    def page_count(self, file_path: str) -> int:
+        if file_path.lower().endswith(".pdf"):
+            kwargs = {"poppler_path": self.poppler_path} if self.poppler_path else {}
+            return int(pdfinfo_from_path(file_path, **kwargs)["Pages"])
+        return 1
+
+    def warm_up(self):
+        # Import OpenCV/pdf2image and run the cleaning path once on a blank page, so the
+        # first request doesn't pay for either
+        import pdf2image  # noqa
+        self.clean_array(np.full((64, 64), 255, np.uint8))
+        return {"opencv": cv2.__version__}
+
+    def iter_pages(self, file_path: str, first_page: int = 1, last_page: int = None):
+        # Yield (page_no, grayscale ndarray), rendering a window of pages at a time
+        if not file_path.lower().endswith(".pdf"):
+            img = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+            if img is None:
+                raise ValueError(f"Could not load image: {file_path}")
+            yield 1, img
+            return
+        if last_page is None:
+            last_page = self.page_count(file_path)
+        kwargs = {"dpi": self.dpi, "grayscale": True}
         if self.poppler_path:
             kwargs["poppler_path"] = self.poppler_path
-        images = convert_from_path(pdf_path, **kwargs)
+        page_no = first_page
+        while page_no <= last_page:
+            upto = min(last_page, page_no + self.render_window - 1)
+            images = convert_from_path(file_path, first_page=page_no, last_page=upto, **kwargs)
+            while images:
+                im = images.pop(0)
+                yield page_no, np.asarray(im.convert("L"))
+                page_no += 1
+            if page_no <= upto:
+                break  # poppler returned fewer pages than asked for
+
+    def extract_text_layer(self, file_path: str, page_no: int):
+        # Word tokens from the PDF text layer (OCR token schema, pixel coords at self.dpi),
+        # or None when the page has no usable text and must be OCR'd
+        if not self.use_text_layer or not file_path.lower().endswith(".pdf"):
+            return None
+        exe = os.path.join(self.poppler_path, "pdftotext") if self.poppler_path else "pdftotext"
+        cmd = [exe, "-bbox", "-enc", "UTF-8", "-f", str(page_no), "-l", str(page_no), file_path, "-"]
+        try:
+            out = subprocess.run(cmd, capture_output=True, timeout=60, check=True).stdout
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning("Text layer unavailable for page %d: %s", page_no, e)
+            return None
+        scale = self.dpi / 72.0
+        tokens = []
+        for x0, y0, x1, y1, txt in self.WORD_PAT.findall(out.decode("utf-8", "replace")):
+            txt = html.unescape(txt).strip()
+            if not txt:
+                continue
+            left, top = int(float(x0) * scale), int(float(y0) * scale)
+            right, bottom = int(float(x1) * scale), int(float(y1) * scale)
+            tokens.append({
+                "text": txt,
+                "left": left, "top": top,
+                "width": right - left, "height": bottom - top,
+                "right": right, "bottom": bottom,
+                "confidence": 100
+            })
+        # Too few words, or mostly symbols (broken font encodings), means image-only
+        readable = sum(1 for t in tokens if any(c.isalnum() for c in t["text"]))
+        if len(tokens) < self.min_text_words or readable < 0.6 * len(tokens):
+            return None
+        return tokens
+
+    def page_output_path(self, file_path: str, page_no: int, output_dir: str):
+        if file_path.lower().endswith(".pdf"):
+            return os.path.join(output_dir, f"page_{page_no:02d}.png")
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        return os.path.join(output_dir, f"{name}_cleaned.png")
+
+    def save_cleaned_page(self, img, file_path: str, page_no: int, output_dir: str, decisions=None):
+        os.makedirs(output_dir, exist_ok=True)
+        cleaned = self.page_output_path(file_path, page_no, output_dir)
+        cv2.imwrite(cleaned, self.clean_array(img, decisions))
+        logger.info("Saved cleaned image: %s", cleaned)
+        return cleaned
+
+    def _process_pdf(self, pdf_path, output_dir):
         out = []
-        for i, im in enumerate(images):
-            tmp = os.path.join(output_dir, f"temp_{i+1}.png")
-            cleaned = os.path.join(output_dir, f"page_{i+1:02d}.png")
-            try:
-                im.save(tmp)
-                self._clean_image(tmp, cleaned)
-            finally:
-                if os.path.exists(tmp):
-                    try:
-                        os.remove(tmp)
-                    except PermissionError:
-                        pass
+        for page_no, img in self.iter_pages(pdf_path):
+            cleaned = self.page_output_path(pdf_path, page_no, output_dir)
+            cv2.imwrite(cleaned, self.clean_array(img))
             out.append(cleaned)
             logger.info("Saved cleaned image: %s", cleaned)
         logger.info("Processed %d page(s)", len(out))
@@ -60,20 +159,71 @@ class FilePreprocessor:
         img = cv2.imread(input_path)
         if img is None:
             raise ValueError(f"Could not load image: {input_path}")
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        gray = self._deskew(gray)
-        den = cv2.fastNlMeansDenoising(gray)
-        thr = cv2.adaptiveThreshold(den, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                    cv2.THRESH_BINARY, 11, 2)
-        kernel = np.ones((1, 1), np.uint8)
-        cleaned = cv2.morphologyEx(thr, cv2.MORPH_CLOSE, kernel)
-        cv2.imwrite(output_path, cleaned)
+        cv2.imwrite(output_path, self.clean_array(img))
+
+    def clean_array(self, img, decisions=None):
+        # Adaptive cascade: only denoise/deskew/binarize when the quality estimate calls for it;
+        # the decisions taken are recorded in `decisions`
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+        q = self.assess_quality(gray)
+        if not self.adaptive:
+            q.update(denoise=True, binarize=True)
+        if q["deskew"]:
+            gray = self._rotate(gray, q["skew"])
+        if q["denoise"]:
+            gray = cv2.fastNlMeansDenoising(gray)
+        if q["binarize"]:
+            thr = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                        cv2.THRESH_BINARY, 11, 2)
+            kernel = np.ones((1, 1), np.uint8)
+            gray = cv2.morphologyEx(thr, cv2.MORPH_CLOSE, kernel)
+        if decisions is not None:
+            decisions.update(q)
+        return gray
+
+    def assess_quality(self, gray):
+        small, scale = self._downscale(gray)
+        # Noise: Immerkaer's Laplacian estimator on a full-resolution centre crop (downscaling
+        # averages noise away), ignoring pixels near text edges
+        h, w = gray.shape[:2]
+        cy, cx = h // 2, w // 2
+        crop = gray[max(0, cy - 256):cy + 256, max(0, cx - 256):cx + 256]
+        resp = np.abs(cv2.filter2D(crop.astype(np.float32), -1, self.NOISE_KERNEL))
+        flat = cv2.dilate(cv2.Canny(crop, 50, 150), np.ones((3, 3), np.uint8)) == 0
+        noise = float(np.sqrt(np.pi / 2) * resp[flat].mean() / 6.0) if flat.any() else 0.0
+        # Share of mid-grey pixels (strided sample, no interpolation); near zero means the
+        # page is already black-and-white
+        sample = gray[::4, ::4]
+        grey_share = float(np.mean((sample > 40) & (sample < 215)))
+        skew = self._estimate_skew(small, scale)
+        return {
+            "noise": round(noise, 2),
+            "contrast": round(float(small.std()), 1),
+            "grey_share": round(grey_share, 4),
+            "skew": round(skew, 2),
+            "denoise": noise > self.noise_threshold,
+            "deskew": abs(skew) > 0.5,
+            "binarize": grey_share > 0.01
+        }
+
+    def _downscale(self, image):
+        h, w = image.shape[:2]
+        scale = min(1.0, self.analysis_size / float(max(h, w)))
+        if scale == 1.0:
+            return image, scale
+        return cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA), scale
 
     def _deskew(self, image):
+        small, scale = self._downscale(image)
+        skew = self._estimate_skew(small, scale)
+        return self._rotate(image, skew) if abs(skew) > 0.5 else image
+
+    def _estimate_skew(self, image, scale=1.0):
+        # Hough on the (reduced) image; threshold scaled so line length requirements match full res
         edges = cv2.Canny(image, 50, 150, apertureSize=3)
-        lines = cv2.HoughLines(edges, 1, np.pi/180, threshold=100)
+        lines = cv2.HoughLines(edges, 1, np.pi/180, threshold=max(30, int(100 * scale)))
         if lines is None or len(lines) == 0:
-            return image
+            return 0.0
         angles = []
         for l in lines[:10]:
             if l is None or len(l) == 0:
@@ -86,12 +236,12 @@ class FilePreprocessor:
             if abs(angle) < 45:
                 angles.append(angle)
         if not angles:
-            return image
-        median = float(np.median(angles))
-        if abs(median) <= 0.5:
-            return image
+            return 0.0
+        return float(np.median(angles))
+
+    def _rotate(self, image, angle):
         h, w = image.shape[:2]
-        M = cv2.getRotationMatrix2D((w // 2, h // 2), median, 1.0)
+        M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
         corrected = cv2.warpAffine(
             image, M, (w, h),
             flags=cv2.INTER_CUBIC,
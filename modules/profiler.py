@@ -0,0 +1,117 @@
+"""
+Module 17: Request profiling
+Goal: Opt-in CPU profile + allocation snapshot for a single job, with time split between
+external tools (tesseract, poppler) and Python work; nothing is installed when profiling is off
+"""
+import os
+import io
+import json
+import time
+import pstats
+import random
+import cProfile
+import logging
+import threading
+import tracemalloc
+
+logger = logging.getLogger("modules.profiler")
+
+# (module file suffix, function) whose cumulative time is spent waiting on a subprocess
+EXTERNAL = {
+    "tesseract": [("pytesseract.py", "run_tesseract")],
+    "poppler": [("pdf2image.py", "convert_from_path"), ("pdf2image.py", "pdfinfo_from_path"),
+                ("subprocess.py", "run")],
+}
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+def should_profile(flag=None, sample_rate: float = 0.0) -> bool:
+    # Explicit flag ("1"/"true"/"yes") wins; otherwise sample a fraction of requests
+    if flag is not None and str(flag).lower() in ("1", "true", "yes", "on"):
+        return True
+    return sample_rate > 0 and random.random() < sample_rate
+
+class JobProfiler:
+    # Profiles the calling thread only (cProfile is per-thread); tracemalloc is process-wide,
+    # so allocation figures include anything else running concurrently
+    def __init__(self, out_dir: str, job_id: str, top: int = 40):
+        self.out_dir = out_dir
+        self.job_id = job_id
+        self.top = top
+        self.summary = None
+
+    def __enter__(self):
+        global _tracemalloc_users
+        with _tracemalloc_lock:
+            if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+            _tracemalloc_users += 1
+        self._t0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+        self._prof = cProfile.Profile()
+        self._prof.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _tracemalloc_users
+        self._prof.disable()
+        wall = time.perf_counter() - self._t0
+        cpu = time.process_time() - self._cpu0
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        current, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        with _tracemalloc_lock:
+            _tracemalloc_users -= 1
+            if _tracemalloc_users == 0:
+                tracemalloc.stop()
+        try:
+            self.summary = self._write(wall, cpu, snapshot, peak)
+        except Exception:
+            logger.exception("Could not write profile for job %s", self.job_id)
+        return False
+
+    def _external(self, stats):
+        # Outermost calls only: convert_from_path calls pdfinfo_from_path (and subprocess.run may sit
+        # under either), so time a counted function spends under another counted one is not re-added
+        out = {}
+        for name, funcs in EXTERNAL.items():
+            counted = lambda key: any(key[0].endswith(suffix) and key[2] == f for suffix, f in funcs)
+            secs = 0.0
+            for key, (_, _, _, ct, callers) in stats.stats.items():
+                if counted(key):
+                    secs += ct - sum(c[3] for caller, c in callers.items() if counted(caller))
+            out[name] = round(max(0.0, secs), 4)
+        return out
+
+    def _write(self, wall, cpu, snapshot, peak):
+        os.makedirs(self.out_dir, exist_ok=True)
+        prof_path = os.path.join(self.out_dir, f"{self.job_id}.prof")
+        self._prof.dump_stats(prof_path)
+
+        buf = io.StringIO()
+        stats = pstats.Stats(self._prof, stream=buf)
+        stats.sort_stats("cumulative").print_stats(self.top)
+        external = self._external(stats)
+        waiting = sum(external.values())
+        top_allocs = []
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+            for s in snapshot.statistics("lineno")[:20]:
+                frame = s.traceback[0]
+                top_allocs.append({"where": f"{frame.filename}:{frame.lineno}",
+                                   "size_kb": round(s.size / 1024, 1), "count": s.count})
+        summary = {
+            "job_id": self.job_id,
+            "wall_seconds": round(wall, 4),
+            "cpu_seconds": round(cpu, 4),
+            "external_seconds": external,
+            "python_seconds": round(max(0.0, wall - waiting), 4),
+            "peak_traced_mb": round(peak / (1024 * 1024), 2),
+            "top_allocations": top_allocs,
+            "top_functions": buf.getvalue().splitlines(),
+            "profile_file": os.path.basename(prof_path),
+        }
+        with open(os.path.join(self.out_dir, f"{self.job_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        logger.info("Profiled job %s: %.2fs wall, external %s", self.job_id, wall, external)
+        return summary
@@ -1,50 +1,125 @@
 """
 Module 3: Rule-based extraction
-Simple regex/keyword heuristics for patient fields and tests
+Compiled keyword/regex rules for patient fields and tests, applied in a single pass over the text
 """
 import re
 
+WORD_PAT = re.compile(r"[a-z]+")
+
+class Rule:
+    # Fires on a line containing any word of `any_of` and every word of `all_of`;
+    # `pattern` group `group` is then passed through `convert` to get the value
+    def __init__(self, field, any_of=(), all_of=(), pattern=r"(.+)", group=1, convert=str.strip,
+                 flags=re.I, first_wins=True):
+        self.field = field
+        self.any_of = frozenset(any_of)
+        self.all_of = frozenset(all_of)
+        self.pattern = re.compile(pattern, flags)
+        self.group = group
+        self.convert = convert
+        self.first_wins = first_wins
+
+    def apply(self, line):
+        m = self.pattern.search(line)
+        if not m:
+            return None
+        return self.convert(m.group(self.group))
+
+class RuleSet:
+    def __init__(self, name, rules, detect=(), value_pat=r"([-+]?\d+(\.\d+)?)",
+                 unit_pat=r"\b(g/dL|mg/dL|mmol/L|/µL|/uL|IU/L|%)\b", patient_lines=40):
+        self.name = name
+        self.rules = list(rules)
+        self.detect = frozenset(detect)  # words that identify this lab's reports
+        self.value_pat = re.compile(value_pat)
+        self.unit_pat = re.compile(unit_pat, re.I)
+        self.patient_lines = patient_lines
+        # Keyword -> rules index: a line's words select candidate rules with one dict
+        # lookup each, so matching cost does not grow with the number of rules
+        self.by_word = {}
+        for i, r in enumerate(self.rules):
+            for w in (r.any_of or r.all_of):
+                self.by_word.setdefault(w, []).append(i)
+
+    def extend(self, name, rules, detect=(), **kwargs):
+        # Lab-specific rules take precedence over (are tried before) the inherited ones
+        opts = {"value_pat": self.value_pat.pattern, "unit_pat": self.unit_pat.pattern,
+                "patient_lines": self.patient_lines}
+        opts.update(kwargs)
+        return RuleSet(name, list(rules) + self.rules, detect, **opts)
+
+    def fired(self, words):
+        hits = set()
+        for w in words:
+            hits.update(self.by_word.get(w, ()))
+        return [i for i in sorted(hits) if self.rules[i].all_of <= words and
+                (not self.rules[i].any_of or self.rules[i].any_of & words)]
+
+def _gender(s):
+    return "Female" if s.lower().startswith("f") else "Male"
+
+DEFAULT_RULES = RuleSet("default", [
+    Rule("name", all_of=["patient", "name"], pattern=r"([^:]*)$"),
+    Rule("age", any_of=["age", "yrs", "years"], pattern=r"(\d{1,3})", convert=int),
+    Rule("gender", any_of=["gender", "sex"], pattern=r"\b(female|male)\b", convert=_gender),
+    Rule("patient_id", any_of=["uhid", "reg", "regn", "regd", "registration"],
+         pattern=r"[:#]\s*([A-Za-z0-9\-]+)", first_wins=False),
+    Rule("patient_id", all_of=["patient", "id"], pattern=r"[:#]\s*([A-Za-z0-9\-]+)", first_wins=False),
+    Rule("date", any_of=["date"], pattern=r"\b\d{1,2}[-/]\d{1,2}[-/]\d{2,4}\b", group=0),
+])
+
+# Thyrocare: "NAME : NAYANA SURTI (61Y/F) SAMPLE COLLECTED AT :"
+THYROCARE_RULES = DEFAULT_RULES.extend("thyrocare", [
+    Rule("name", all_of=["name"], pattern=r"\b(?i:name)\s*:\s*([A-Z .']+?)\s*\(\d{1,3}\s*Y", flags=0),
+    Rule("age", all_of=["name"], pattern=r"\((\d{1,3})\s*Y\s*/\s*[MF]\)", convert=int),
+    Rule("gender", all_of=["name"], pattern=r"\(\d{1,3}\s*Y\s*/\s*([MF])\)", convert=_gender),
+], detect=["thyrocare", "thyracare"])
+
+RULE_SETS = {rs.name: rs for rs in (DEFAULT_RULES, THYROCARE_RULES)}
+
+def register_rule_set(rule_set):
+    # Extractors created afterwards pick it up; call compile() on existing ones
+    RULE_SETS[rule_set.name] = rule_set
+
 class RuleBasedExtractor:
-    def __init__(self):
-        # Example patterns; extend to your lab formats
-        self.name_keys = [r"patient\s*name", r"pt\.?\s*name", r"name"]
-        self.age_keys = [r"\bage\b", r"age[:\s]"]
-        self.gender_keys = [r"\bsex\b", r"gender"]
-        self.id_keys = [r"(patient|reg|uhid|id)\s*[:#]?\s*([A-Za-z0-9\-]+)"]
-        self.date_keys = [r"\b\d{1,2}[-/]\d{1,2}[-/]\d{2,4}\b"]
-
-        # Test rows: naive pattern "Name value unit"
-        self.value_pat = re.compile(r"([-+]?\d+(\.\d+)?)")
-        self.unit_pat = re.compile(r"\b(g/dL|mg/dL|mmol/L|/µL|/uL|IU/L|%)\b", re.I)
-
-    def extract(self, text: str):
+    def __init__(self, rule_sets=None, default="default"):
+        self.rule_sets = rule_sets if rule_sets is not None else RULE_SETS
+        self.default = default
+        self.compile()
+
+    def compile(self):
+        # Every lab's detect words in one alternation; the named group that matches is the lab
+        self._labs = [rs for rs in self.rule_sets.values() if rs.detect]
+        alts = [f"(?P<rs{i}>{'|'.join(map(re.escape, sorted(rs.detect)))})" for i, rs in enumerate(self._labs)]
+        self._detect_pat = re.compile(r"\b(?:" + "|".join(alts) + r")\b", re.I) if alts else None
+
+    def select_rule_set(self, text):
+        m = self._detect_pat.search(text) if self._detect_pat else None
+        if m:
+            return self._labs[int(m.lastgroup[2:])]
+        return self.rule_sets[self.default]
+
+    def extract(self, text: str, rule_set: str = None):
         lines = [l.strip() for l in text.splitlines() if l.strip()]
+        rs = self.rule_sets[rule_set] if rule_set else self.select_rule_set(text)
         patient = {}
         tests = []
 
-        # Patient fields (very simple; improve as needed)
-        for l in lines[:40]:
-            low = l.lower()
-            if "name" in low and "patient" in low and "name" not in patient:
-                patient["name"] = l.split(":")[-1].strip()
-            if any(k in low for k in ["age", "yrs", "years"]) and "age" not in patient:
-                m = re.search(r"(\d{1,3})", l)
-                if m: patient["age"] = int(m.group(1))
-            if any(k in low for k in ["gender", "sex"]) and "gender" not in patient:
-                if "male" in low: patient["gender"] = "Male"
-                elif "female" in low: patient["gender"] = "Female"
-            if "uhid" in low or "reg" in low or "patient id" in low:
-                m = re.search(r"[:#]\s*([A-Za-z0-9\-]+)", l)
-                if m: patient["patient_id"] = m.group(1)
-            if "date" in low and "date" not in patient:
-                m = re.search(r"\b\d{1,2}[-/]\d{1,2}[-/]\d{2,4}\b", l)
-                if m: patient["date"] = m.group(0)
-
-        # Tests: very naive parse; refine per lab layout
-        for l in lines:
-            val = self.value_pat.search(l)
+        # Single pass: each line yields patient fields (header lines only) and a test candidate
+        for n, l in enumerate(lines):
+            if n < rs.patient_lines:
+                words = set(WORD_PAT.findall(l.lower()))
+                for i in rs.fired(words):
+                    r = rs.rules[i]
+                    if r.first_wins and r.field in patient:
+                        continue
+                    value = r.apply(l)
+                    if value is not None:
+                        patient[r.field] = value
+
+            val = rs.value_pat.search(l)
             if not val: continue
-            unit = self.unit_pat.search(l)
+            unit = rs.unit_pat.search(l)
             name = l
             tests.append({
                 "name": name if len(name) < 60 else name[:60],
@@ -53,4 +128,4 @@ class RuleBasedExtractor:
                 "confidence": 0.6  # baseline; blended later with ML
             })
 
-        return {"patient": patient, "tests": tests}
+        return {"patient": patient, "tests": tests, "rule_set": rs.name}
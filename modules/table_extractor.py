@@ -0,0 +1,146 @@
+"""
+Module 12: Layout-aware table extraction
+Goal: Find result tables from token geometry (header words -> column x-bands) and read
+structured rows (name, value, unit, reference range) instead of guessing from flattened text
+"""
+import re
+import numpy as np
+
+from modules.token_store import TokenStore
+
+# Header words -> column role
+HEADER_ROLES = {
+    "test": "name", "investigation": "name", "parameter": "name", "description": "name",
+    "value": "value", "result": "value", "results": "value", "observed": "value",
+    "unit": "unit", "units": "unit",
+    "reference": "range", "range": "range", "interval": "range", "biological": "range", "normal": "range",
+    "technology": "method", "method": "method",
+}
+NUMBER_PAT = re.compile(r"^([<>]=?)?([-+]?\d+(?:[.,]\d+)?)$")
+QUALIFIERS = {"<", ">", "<=", ">=", "</=", ">/="}
+UNIT_PAT = re.compile(r"^(%|[a-zµu]*/[a-zµ0-9^.]+|[mµunp]?(?:g|mol|iu|u|l)(?:/[a-z0-9.]+)?|fl|pg|mill/cumm)$", re.I)
+FLAGS = {"h", "l", "high", "low", "hh", "ll", "a", "abnormal", "critical"}
+RANGE_PAT = re.compile(r"^([<>]=?)?\d+(?:\.\d+)?(?:\s*[-–]\s*\d+(?:\.\d+)?)?$")
+
+class TableExtractor:
+    def __init__(self, min_roles: int = 3, line_threshold: int = 10):
+        self.min_roles = min_roles  # header must name at least this many columns, one being "value"
+        self.line_threshold = line_threshold
+
+    def find_header(self, store: TokenStore, idx):
+        # Column layout [(role, x0, x1)] sorted by x if this line is a table header, else None
+        groups = {}
+        for i in idx:
+            role = HEADER_ROLES.get(store.text(int(i)).lower().strip(":."))
+            if role is None:
+                continue
+            x0, x1 = int(store.left[i]), int(store.right[i])
+            g = groups.get(role)
+            groups[role] = (x0, x1) if g is None else (min(g[0], x0), max(g[1], x1))
+        if "value" not in groups or len(groups) < self.min_roles:
+            return None
+        cols = sorted(((r, x0, x1) for r, (x0, x1) in groups.items()), key=lambda c: c[1])
+        # Data cells sit roughly under their header: a column starts a quarter of the
+        # whitespace before its header word, which leaves room for left-aligned long names
+        bounds = [c[1] - 0.25 * max(0, c[1] - p[2]) for p, c in zip(cols, cols[1:])]
+        return {"roles": [c[0] for c in cols], "bounds": np.array(bounds)}
+
+    def parse_row(self, store: TokenStore, idx, layout, page=None):
+        roles = layout["roles"]
+        centres = (store.left[idx] + store.right[idx]) / 2.0
+        col = np.searchsorted(layout["bounds"], centres, side="right")
+        cells = {}
+        for i, c in zip(idx, col):
+            cells.setdefault(roles[c], []).append(int(i))
+
+        # Value: first number in the value column, optionally preceded by < / >
+        value, qualifier, value_tok, flag = None, None, None, None
+        for i in cells.get("value", []):
+            t = store.text(i)
+            m = NUMBER_PAT.match(t)
+            if m and value is None:
+                qualifier = m.group(1) or qualifier
+                value, value_tok = float(m.group(2).replace(",", ".")), i
+            elif t in QUALIFIERS and value is None:
+                qualifier = t
+            elif t.lower() in FLAGS:
+                flag = t
+        if value is None:
+            return None
+        # Table cells are separated by whitespace; prose wrapping into the column is not
+        pos = list(idx).index(value_tok)
+        if pos > 0:
+            prev = int(idx[pos - 1])
+            gap = int(store.left[value_tok]) - int(store.right[prev])
+            if store.text(prev) not in QUALIFIERS and gap < 2 * int(np.median(store.height[idx])):
+                return None
+
+        name = " ".join(store.text(i) for i in cells.get("name", [])).strip(" :-")
+        if not name or not re.search(r"[A-Za-z]", name):
+            return None
+        units = [store.text(i) for i in cells.get("unit", [])]
+        if not units:
+            units = [store.text(i) for i in cells.get("value", []) if UNIT_PAT.match(store.text(i))]
+        ref = " ".join(store.text(i) for i in cells.get("range", [])).strip()
+        if "range" not in roles:
+            # No range column (e.g. header carried over from another page): a range printed
+            # after the unit lands in the unit cell
+            for k in range(1, len(units)):
+                if units[k] in QUALIFIERS or RANGE_PAT.match(units[k]):
+                    units, ref = units[:k], " ".join(units[k:])
+                    break
+        row = {
+            "name": name,
+            "value": value,
+            "unit": " ".join(units) or None,
+            "reference_range": ref or None,
+            "confidence": round(0.5 + 0.4 * max(0, int(store.confidence[value_tok])) / 100.0, 3),
+        }
+        if qualifier:
+            row["qualifier"] = qualifier
+        if flag:
+            row["flag"] = flag
+        if page is not None:
+            row["page"] = page
+        return row
+
+    def extract(self, store: TokenStore, layout=None, page=None):
+        # Rows of one page; `layout` carries a header over from a previous page
+        store = TokenStore.from_dicts(store)
+        rows = []
+        for idx in store.line_indices(self.line_threshold):
+            header = self.find_header(store, idx)
+            if header is not None:
+                layout = header
+                continue
+            if layout is None:
+                continue
+            row = self.parse_row(store, idx, layout, page)
+            if row is not None:
+                rows.append(row)
+        return rows, layout
+
+    def table_tokens(self, stores):
+        # Per page, token indices of the result table: from a header on that page (or, when the
+        # header carried over, from the first parsed row) to the bottom, plus every parsed row
+        out, layout = [], None
+        for n, store in enumerate(stores, 1):
+            store = TokenStore.from_dicts(store)
+            keep, started = set(), False
+            for idx in store.line_indices(self.line_threshold):
+                header = self.find_header(store, idx)
+                if header is not None:
+                    layout, started = header, True
+                elif layout is not None and self.parse_row(store, idx, layout, n) is not None:
+                    started = True
+                if started:
+                    keep.update(int(i) for i in idx)
+            out.append(keep)
+        return out
+
+    def extract_pages(self, stores):
+        rows, layout = [], None
+        for n, store in enumerate(stores, 1):
+            page_rows, layout = self.extract(store, layout, page=n)
+            rows.extend(page_rows)
+        return rows
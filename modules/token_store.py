@@ -0,0 +1,222 @@
+"""
+Module 11: Columnar token store
+Goal: Keep OCR tokens in parallel NumPy arrays so layout steps run vectorized on dense pages,
+and persist them in a compact, memory-mappable binary format
+
+Binary layout (.tokens): magic | uint32 count | uint32 meta length | JSON meta (padded to 8 bytes)
+| count fixed-width records (RECORD) | UTF-8 text blob, sliced by each record's text_end
+"""
+import os
+import sys
+import json
+import struct
+import argparse
+import numpy as np
+
+MAGIC = b"LRTOKv1\0"
+RECORD = np.dtype([("left", "<i4"), ("top", "<i4"), ("width", "<i4"), ("height", "<i4"),
+                   ("confidence", "<i4"), ("text_end", "<i4")])
+
+class TokenStore:
+    # left/top/width/height/confidence as int32 arrays; text packed into one string + offsets
+    FIELDS = ("left", "top", "width", "height", "confidence")
+
+    def __init__(self, texts, left, top, width, height, confidence):
+        self.left = np.asarray(left, dtype=np.int32)
+        self.top = np.asarray(top, dtype=np.int32)
+        self.width = np.asarray(width, dtype=np.int32)
+        self.height = np.asarray(height, dtype=np.int32)
+        self.confidence = np.asarray(confidence, dtype=np.int32)
+        texts = list(texts)
+        self._text = "".join(texts)
+        self.offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        if texts:
+            np.cumsum([len(t) for t in texts], out=self.offsets[1:])
+
+    @classmethod
+    def from_dicts(cls, tokens):
+        if isinstance(tokens, cls):
+            return tokens
+        return cls([t["text"] for t in tokens], *([t[f] for t in tokens] for f in cls.FIELDS))
+
+    @property
+    def right(self):
+        return self.left + self.width
+
+    @property
+    def bottom(self):
+        return self.top + self.height
+
+    def __len__(self):
+        return len(self.left)
+
+    def text(self, i):
+        return self._text[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i):
+        # Dict view in the original per-token schema
+        if i < 0:
+            i += len(self)
+        left, top = int(self.left[i]), int(self.top[i])
+        width, height = int(self.width[i]), int(self.height[i])
+        return {
+            "text": self.text(i),
+            "left": left, "top": top,
+            "width": width, "height": height,
+            "right": left + width, "bottom": top + height,
+            "confidence": int(self.confidence[i])
+        }
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def to_dicts(self, idx=None):
+        return [self[int(i)] for i in (range(len(self)) if idx is None else idx)]
+
+    def take(self, idx):
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            idx = np.flatnonzero(idx)
+        return TokenStore([self.text(int(i)) for i in idx], self.left[idx], self.top[idx],
+                          self.width[idx], self.height[idx], self.confidence[idx])
+
+    def filter(self, min_confidence: int = None, region=None):
+        # region = (x0, y0, x1, y1); keeps tokens whose centre falls inside
+        mask = np.ones(len(self), dtype=bool)
+        if min_confidence is not None:
+            mask &= self.confidence > min_confidence
+        if region is not None:
+            cx = self.left + self.width // 2
+            cy = self.top + self.height // 2
+            x0, y0, x1, y1 = region
+            mask &= (cx >= x0) & (cx <= x1) & (cy >= y0) & (cy <= y1)
+        return self.take(mask)
+
+    def sorted(self):
+        return self.take(np.lexsort((self.left, self.top)))
+
+    def line_indices(self, line_threshold: int = 10):
+        # A line is every token whose top is within line_threshold of the line's first
+        # (topmost) token; one binary search per line instead of a per-token loop
+        if len(self) == 0:
+            return []
+        order = np.lexsort((self.left, self.top))
+        tops = self.top[order]
+        bounds = []
+        start, n = 0, len(order)
+        while start < n:
+            start = int(np.searchsorted(tops, tops[start] + line_threshold, side="right"))
+            bounds.append(start)
+        labels = np.repeat(np.arange(len(bounds)), np.diff(np.concatenate(([0], bounds))))
+        within = order[np.lexsort((self.left[order], labels))]
+        return np.split(within, bounds[:-1])
+
+    def line_texts(self, line_threshold: int = 10):
+        return [" ".join(self.text(int(i)) for i in idx) for idx in self.line_indices(line_threshold)]
+
+    def columns(self, min_gap: int = 40, idx=None):
+        # x-bands separated by vertical whitespace of at least min_gap pixels, plus the
+        # band index of every token (optionally restricted to `idx`)
+        idx = np.arange(len(self)) if idx is None else np.asarray(idx)
+        if len(idx) == 0:
+            return [], np.zeros(0, dtype=np.int64)
+        left, right = self.left[idx], self.right[idx]
+        width = int(right.max()) + 1
+        cover = np.zeros(width + 1, dtype=np.int32)
+        np.add.at(cover, left, 1)
+        np.add.at(cover, right, -1)
+        filled = np.cumsum(cover)[:width] > 0
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], filled.astype(np.int8), [0]))))
+        bands = [[int(a), int(b)] for a, b in zip(edges[::2], edges[1::2])]
+        merged = [bands[0]]
+        for a, b in bands[1:]:
+            if a - merged[-1][1] < min_gap:
+                merged[-1][1] = b
+            else:
+                merged.append([a, b])
+        starts = np.array([a for a, _ in merged])
+        centres = (left + right) // 2
+        return [tuple(b) for b in merged], np.searchsorted(starts, centres, side="right") - 1
+
+    def save(self, path: str, image_path: str = None):
+        # One buffer, one write
+        encoded = [self.text(i).encode("utf-8") for i in range(len(self))]
+        rec = np.zeros(len(self), dtype=RECORD)
+        for f in self.FIELDS:
+            rec[f] = getattr(self, f)
+        rec["text_end"] = np.cumsum([len(b) for b in encoded]) if encoded else []
+        meta = json.dumps({"image_path": image_path}).encode("utf-8")
+        meta += b" " * (-(len(MAGIC) + 8 + len(meta)) % 8)
+        with open(path, "wb") as f:
+            f.write(b"".join([MAGIC, struct.pack("<II", len(self), len(meta)), meta,
+                              rec.tobytes(), b"".join(encoded)]))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        # Returns (store, meta); numeric columns are views into the memory-mapped file
+        buf = np.memmap(path, dtype=np.uint8, mode="r") if mmap else np.fromfile(path, dtype=np.uint8)
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"Not a token file: {path}")
+        pos = len(MAGIC)
+        count, meta_len = struct.unpack("<II", bytes(buf[pos:pos + 8]))
+        pos += 8
+        meta = json.loads(bytes(buf[pos:pos + meta_len]))
+        pos += meta_len
+        rec = buf[pos:pos + count * RECORD.itemsize].view(RECORD)
+        blob = bytes(buf[pos + count * RECORD.itemsize:])
+        ends = rec["text_end"].tolist()
+        starts = [0] + ends[:-1]
+        texts = [blob[a:b].decode("utf-8") for a, b in zip(starts, ends)]
+        return cls(texts, *(rec[f] for f in cls.FIELDS)), meta
+
+def load_tokens(path: str):
+    # One loader for both artifact formats: tokens_*.json and tokens_*.tokens
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        store = TokenStore.from_dicts(data.get("tokens", []))
+        image_path = data.get("image_path")
+    else:
+        store, meta = TokenStore.load(path)
+        image_path = meta.get("image_path")
+    return {"image_path": image_path, "tokens": store, "total_tokens": len(store)}
+
+def convert_json_dir(directory: str, remove: bool = False):
+    # Convert every tokens_*.json in `directory` to the binary format
+    converted = []
+    for fn in sorted(os.listdir(directory)):
+        if not (fn.startswith("tokens_") and fn.endswith(".json")):
+            continue
+        src = os.path.join(directory, fn)
+        dst = src[:-len(".json")] + ".tokens"
+        data = load_tokens(src)
+        data["tokens"].save(dst, data["image_path"])
+        converted.append((src, os.path.getsize(src), os.path.getsize(dst)))
+        if remove:
+            os.remove(src)
+    return converted
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Token artifact tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    conv = sub.add_parser("convert", help="Convert tokens_*.json files to .tokens")
+    conv.add_argument("directory")
+    conv.add_argument("--remove", action="store_true", help="Delete the JSON files afterwards")
+    show = sub.add_parser("show", help="Print the text lines of a token file (either format)")
+    show.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "convert":
+        items = convert_json_dir(args.directory, args.remove)
+        for src, before, after in items:
+            print(f"{os.path.basename(src)}: {before} -> {after} bytes")
+        print(f"Converted {len(items)} file(s)")
+    else:
+        data = load_tokens(args.path)
+        print(f"# {data['image_path']} ({data['total_tokens']} tokens)")
+        for line in data["tokens"].line_texts():
+            print(line)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
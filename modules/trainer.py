@@ -0,0 +1,93 @@
+"""
+Module 15: Background retraining
+Goal: Batch new corrections into incremental training runs off the request path, and swap the
+retrained model in without blocking extractions
+"""
+import time
+import logging
+import threading
+
+logger = logging.getLogger("modules.trainer")
+
+class BackgroundTrainer:
+    # Trains once `batch` corrections are pending, or `interval` seconds after the oldest
+    # pending one arrived, whichever comes first; nothing before `min_total` corrections exist
+    def __init__(self, ml_extractor, hitl_manager, batch: int = 5, interval: float = 30.0, min_total: int = 5):
+        self.ml = ml_extractor
+        self.hitl = hitl_manager
+        self.batch = batch
+        self.interval = interval
+        self.min_total = min_total
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.last_run = None   # {"version", "corrections", "seconds", "finished_at"}
+        self.last_error = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="trainer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def notify(self):
+        # Called after each saved correction; cheap, never trains on the caller's thread
+        self._wake.set()
+
+    def lag(self):
+        pending, oldest = self.hitl.store.pending_since(self.hitl.store.seq_for_version(self.ml.version))
+        return {"pending_corrections": pending,
+                "lag_seconds": round(time.time() - oldest, 1) if oldest else 0.0}
+
+    def _due(self):
+        if self.hitl.count() < self.min_total:
+            return False
+        lag = self.lag()
+        return lag["pending_corrections"] >= self.batch or \
+            (lag["pending_corrections"] > 0 and lag["lag_seconds"] >= self.interval)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(max(1.0, self.interval / 4))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                if self._due():
+                    self.train_now()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.exception("Background training failed")
+
+    def train_now(self):
+        # Only corrections newer than the live model's version; the swap is a single assignment
+        store = self.hitl.store
+        t0 = time.perf_counter()
+        # Build on the newest saved version, not a stale in-memory one (e.g. a restarted process)
+        self.ml.refresh()
+        last_seq = store.last_seq()
+        new = self.hitl.corrections_since(self.ml.version)
+        if not new:
+            return None
+        # Any loaded version holds everything up to it (patient memory and/or test scorer); only
+        # version 0 starts from scratch, matching corrections_since()
+        scores = self.ml.train(new, incremental=self.ml.version > 0)
+        store.record_training(self.ml.version, last_seq)
+        self.runs += 1
+        self.last_error = None
+        self.last_run = {"version": self.ml.version, "corrections": len(new),
+                         "seconds": round(time.perf_counter() - t0, 4), "finished_at": time.time()}
+        logger.info("Trained model v%d on %d new correction(s)", self.ml.version, len(new))
+        return scores
+
+    def stats(self):
+        return {"model_version": self.ml.version, "runs": self.runs, "last_run": self.last_run,
+                "last_error": self.last_error, "batch": self.batch, "interval": self.interval, **self.lag()}
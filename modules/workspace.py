@@ -0,0 +1,38 @@
+"""
+Module 8: Job workspaces
+Goal: Give every job its own directory and collision-free ID so concurrent requests never share files
+"""
+import os
+import uuid
+import shutil
+import logging
+from datetime import datetime
+
+logger = logging.getLogger("modules.workspace")
+
+def new_job_id() -> str:
+    # Timestamp keeps IDs sortable; the random suffix makes them unique across workers
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+class Workspace:
+    def __init__(self, root: str, job_id: str = None, keep: bool = False):
+        self.job_id = job_id or new_job_id()
+        self.path = os.path.join(root, self.job_id)
+        self.keep = keep
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, os.path.basename(name))
+
+    def __enter__(self):
+        os.makedirs(self.path, exist_ok=True)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+    def cleanup(self):
+        if self.keep:
+            logger.info("Kept workspace: %s", self.path)
+        else:
+            shutil.rmtree(self.path, ignore_errors=True)
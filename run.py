@@ -1,21 +1,26 @@
 """
 Simple script to run the Lab Report Digitization system
+
+    python run.py                      # development: one process, auto-reload
+    JOB_BACKEND=sqlite python run.py --workers 4   # production: warm up once, pre-fork 4 serving workers
 """
 import os
 import sys
+import time
+import signal
+import socket
+import argparse
 
 def check_dependencies():
-    try:
-        import cv2  # noqa
-        import pytesseract  # noqa
-        from pdf2image import convert_from_path  # noqa
-        import fastapi  # noqa
-        print("✅ All Python dependencies found")
-        return True
-    except ImportError as e:
-        print(f"❌ Missing dependency: {e}")
+    # Locate, don't import: the heavy imports happen in warm-up (or on first use)
+    from importlib.util import find_spec
+    missing = [m for m in ("cv2", "pytesseract", "pdf2image", "sklearn", "fastapi", "uvicorn") if find_spec(m) is None]
+    if missing:
+        print(f"❌ Missing dependency: {', '.join(missing)}")
         print("Please run: pip install -r requirements.txt")
         return False
+    print("✅ All Python dependencies found")
+    return True
 
 def create_directories():
     dirs = [
@@ -26,7 +31,87 @@ def create_directories():
         os.makedirs(d, exist_ok=True)
     print("✅ Created necessary directories")
 
+def serve_worker(api, sock, index):
+    # Runs in a forked child: the parent already imported and warmed the pipeline
+    import uvicorn
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # One trainer for the whole server; the other workers reload the versions it writes
+    api.RUN_TRAINER = api.RUN_TRAINER and index == 0
+    # A replacement worker is forked from the parent's warm-up state; pick up any model trained since
+    api.ml_extractor.refresh()
+    server = uvicorn.Server(uvicorn.Config(api.app, log_level="info", timeout_graceful_shutdown=30))
+    server.run(sockets=[sock])
+
+def serve_prefork(host, port, workers):
+    # Import + warm up (OpenCV, tesseract probe, model load) once, then fork; children share the
+    # warmed, copy-on-write memory and the listening socket, so each is ready as soon as it forks
+    os.environ.setdefault("OCR_WORKERS", str(max(1, (os.cpu_count() or 1) // workers)))
+    import main as api
+    status = api.warm_up()
+    print(f"🔥 Warmed up in {status['warm_up_seconds']:.2f}s")
+    if not status["ready"]:
+        print(f"⚠️ Not all components are ready: {status['components']}")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = {}
+    stopping = False
+
+    def spawn(index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                serve_worker(api, sock, index)
+            except BaseException:
+                code = 1
+            os._exit(code)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for i in range(workers):
+        spawn(i)
+    print(f"🚀 Serving on http://{host}:{port} with {workers} pre-forked worker(s) (OCR_WORKERS={os.environ['OCR_WORKERS']} each)")
+    print("Press Ctrl+C to stop")
+
+    while children:
+        try:
+            pid, code = os.wait()
+        except ChildProcessError:
+            break
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            # Crashed or killed; replace it (no warm-up needed, the parent is still warm)
+            print(f"⚠️ Worker {index} (pid {pid}) exited with status {code}; restarting")
+            time.sleep(1)
+            spawn(index)
+    sock.close()
+    print("\n👋 Server stopped")
+    return 0
+
 def main():
+    parser = argparse.ArgumentParser(description="Run the Lab Report Digitization API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="Pre-forked serving workers (production mode)")
+    parser.add_argument("--prod", action="store_true", help="Production mode even with one worker (no reload)")
+    args = parser.parse_args()
+
     print("Lab Report Digitization System")
     print("=" * 40)
 
@@ -35,14 +120,24 @@ def main():
 
     create_directories()
 
+    if args.workers > 1 and os.environ.get("JOB_BACKEND", "local") != "sqlite":
+        # In-process jobs live in one worker's memory: polls and admission would split across workers
+        print("❌ --workers > 1 needs the shared job queue: set JOB_BACKEND=sqlite and run worker.py")
+        return 1
+    if args.prod or args.workers > 1:
+        if hasattr(os, "fork"):
+            return serve_prefork(args.host, args.port, max(1, args.workers))
+        print("⚠️ Pre-forking needs os.fork; serving from a single process")
+
     print("🚀 Starting FastAPI server...")
-    print("📱 Web interface: http://localhost:8000")
-    print("📚 API docs: http://localhost:8000/docs")
+    print(f"📱 Web interface: http://localhost:{args.port}")
+    print(f"📚 API docs: http://localhost:{args.port}/docs")
     print("Press Ctrl+C to stop")
 
     try:
         import uvicorn
-        uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+        dev = not (args.prod or args.workers > 1)
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=dev)
     except KeyboardInterrupt:
         print("\n👋 Server stopped")
     except Exception as e:
@@ -0,0 +1,84 @@
+"""
+Queue worker for the Lab Report Digitization system
+Pulls jobs from the durable SQLite queue (API started with JOB_BACKEND=sqlite) and runs the pipeline.
+Start as many as you like, on this host or others sharing the project volume.
+"""
+import os
+import sys
+import time
+import shutil
+import socket
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger("worker")
+
+def run_job(api, queue, job, worker_id):
+    job_id = job["id"]
+    stop = threading.Event()
+
+    def keep_lease():
+        # Pages can take a while; keep the lease alive between progress updates
+        while not stop.wait(queue.lease_seconds / 3):
+            queue.heartbeat(job_id, worker_id)
+
+    threading.Thread(target=keep_lease, daemon=True).start()
+    logger.info("Running job %s (attempt %d)", job_id, job["attempts"] + 1)
+    try:
+        result = api.run_job(
+            job["file_path"], job_id,
+            progress=lambda done, total: queue.heartbeat(job_id, worker_id, done),
+            profile=bool(job["profile"])
+        )
+        queue.complete(job_id, worker_id, result["output_file"])
+        logger.info("Finished job %s", job_id)
+    except Exception as e:
+        logger.exception("Job %s failed", job_id)
+        queue.fail(job_id, worker_id, str(e))
+    finally:
+        stop.set()
+    # Keep the upload around while the job may still be retried
+    if queue.get(job_id)["status"] in ("done", "failed"):
+        shutil.rmtree(os.path.dirname(job["file_path"]), ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Lab report OCR queue worker")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}:{os.getpid()}")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+    parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+    args = parser.parse_args()
+
+    # Loads the OCR/extraction components once for this worker
+    import main as api
+    from modules.job_queue import SQLiteJobQueue
+    queue = api.job_queue or SQLiteJobQueue(
+        api.P("data/queue/jobs.db"),
+        lease_seconds=float(os.environ.get("JOB_LEASE_SECONDS", 300))
+    )
+
+    status = api.warm_up()
+    if not status["ready"]:
+        print(f"⚠️ Not all components are ready: {status['components']}")
+    print(f"👷 Worker {args.worker_id} polling {queue.db_path}")
+    try:
+        while True:
+            job = queue.claim(args.worker_id)
+            if job is None:
+                if args.once:
+                    break
+                time.sleep(args.poll_interval)
+                continue
+            # Corrections retrain the model in the API process; load any newer version first
+            if api.ml_extractor.refresh():
+                logger.info("Loaded model v%d", api.ml_extractor.version)
+            run_job(api, queue, job, args.worker_id)
+    except KeyboardInterrupt:
+        # Any job we were running is re-queued once its lease expires
+        print("\n👋 Worker stopped")
+    finally:
+        api.page_pipeline.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())